@@ -0,0 +1,291 @@
+"""
+Offline benchmark for the download -> process -> deliver pipeline.
+
+Generates synthetic sources with ffmpeg, serves them from a local HTTP server so
+yt-dlp's generic extractor can fetch them without internet access, runs a mix of
+VideoJobs through VideoDownloader and reports per-stage wall time, CPU time,
+peak RSS, peak scratch bytes and encode passes.
+
+    python -m bench.benchmark                       # run and print a report
+    python -m bench.benchmark --save-baseline       # store results as the baseline
+    python -m bench.benchmark --baseline bench/baseline.json   # fail on regressions
+"""
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+import statistics
+from collections import defaultdict
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lib.download import VideoDownloader, VideoJob  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# name: (size, duration, video codec args, audio codec args, extension)
+SOURCES = {
+    "720p_h264_30s": ("1280x720", 30, ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23'], ['-c:a', 'aac'], "mp4"),
+    "1080p_h264_60s": ("1920x1080", 60, ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '12'], ['-c:a', 'aac'], "mp4"),
+    "480p_vp9_20s": ("854x480", 20, ['-c:v', 'libvpx-vp9', '-deadline', 'realtime', '-cpu-used', '8', '-b:v', '1M'],
+                     ['-c:a', 'libopus'], "webm"),
+}
+
+# name: (source, VideoJob keyword arguments)
+JOBS = {
+    "mp4_trim": ("720p_h264_30s", dict(format="mp4", start_time="0:00:05", end_time="0:00:15")),
+    "mp4_copy": ("720p_h264_30s", dict(format="mp4")),
+    "mp3": ("720p_h264_30s", dict(format="mp3")),
+    "gif": ("480p_vp9_20s", dict(format="gif", start_time="0:00:02", end_time="0:00:10")),
+    "mp4_oversize": ("1080p_h264_60s", dict(format="mp4")),
+}
+
+# Metrics where larger is worse, compared against the baseline
+COMPARED = ("wall", "cpu", "peak_rss_mb", "peak_scratch_mb", "encodes")
+
+def generate_sources(folder: str):
+    os.makedirs(folder, exist_ok=True)
+    for name, (size, duration, vcodec, acodec, ext) in SOURCES.items():
+        path = os.path.join(folder, f"{name}.{ext}")
+        if os.path.exists(path):
+            continue
+        print(f"Generating {path}")
+        subprocess.run([
+            'ffmpeg', '-v', 'error',
+            '-f', 'lavfi', '-i', f"testsrc2=size={size}:rate=30:duration={duration}",
+            '-f', 'lavfi', '-i', f"sine=frequency=440:sample_rate=48000:duration={duration}",
+            *vcodec, '-pix_fmt', 'yuv420p', *acodec, '-movflags', '+faststart', '-y', path
+        ], check=True)
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """SimpleHTTPRequestHandler plus single-range support, which ranged and seeking reads rely on."""
+    def log_message(self, format, *args):
+        pass
+
+    def send_head(self):
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        path = self.translate_path(self.path)
+        if not match or not os.path.isfile(path):
+            return super().send_head()
+        size = os.path.getsize(path)
+        start = int(match.group(1))
+        end = min(int(match.group(2)) if match.group(2) else size - 1, size - 1)
+        if start >= size:
+            self.send_error(416)
+            return None
+        f = open(path, 'rb')
+        f.seek(start)
+        self.send_response(206)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Content-Range', f"bytes {start}-{end}/{size}")
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        self._remaining = end - start + 1
+        return f
+
+    def copyfile(self, source, outputfile):
+        remaining = getattr(self, '_remaining', None)
+        if remaining is None:
+            return super().copyfile(source, outputfile)
+        while remaining > 0:
+            chunk = source.read(min(64 * 1024, remaining))
+            if not chunk:
+                break
+            outputfile.write(chunk)
+            remaining -= len(chunk)
+
+def serve(folder: str) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(RangeRequestHandler, directory=folder))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def _child_rss_kb(parent: int) -> int:
+    """RSS of direct children (ffmpeg) plus this process, from /proc."""
+    total = 0
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+            if ppid != parent and int(pid) != parent:
+                continue
+            with open(f'/proc/{pid}/status') as f:
+                total += next((int(l.split()[1]) for l in f if l.startswith('VmRSS:')), 0)
+        except (OSError, ValueError, IndexError):
+            continue
+    return total
+
+class Sampler:
+    """Samples peak RSS and scratch-folder bytes while a job runs."""
+    def __init__(self, folder: str, interval: float = 0.05):
+        self.folder = folder
+        self.interval = interval
+        self.peak_rss_kb = 0
+        self.peak_scratch = 0
+        self._stop = threading.Event()
+
+    def _scratch_bytes(self) -> int:
+        total = 0
+        for root, _, files in os.walk(self.folder):
+            for name in files:
+                try:
+                    total += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+        return total
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_rss_kb = max(self.peak_rss_kb, _child_rss_kb(os.getpid()))
+            self.peak_scratch = max(self.peak_scratch, self._scratch_bytes())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+def _cpu_seconds() -> float:
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+class InstrumentedDownloader(VideoDownloader):
+    """
+    VideoDownloader that records wall and CPU time per pipeline stage and counts encodes.
+    Stages do not overlap: a probe run from inside _process counts as probe only.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stages = defaultdict(lambda: {'wall': 0.0, 'cpu': 0.0})
+        self.encodes = 0
+        self._nested = []  # [wall, cpu] spent in timed stages called by each running stage
+
+    def _timed(self, stage, func, *args, **kwargs):
+        wall, cpu = time.perf_counter(), _cpu_seconds()
+        self._nested.append([0.0, 0.0])
+        try:
+            return func(*args, **kwargs)
+        finally:
+            wall, cpu = time.perf_counter() - wall, _cpu_seconds() - cpu
+            inner_wall, inner_cpu = self._nested.pop()
+            self.stages[stage]['wall'] += wall - inner_wall
+            self.stages[stage]['cpu'] += cpu - inner_cpu
+            if self._nested:
+                self._nested[-1][0] += wall
+                self._nested[-1][1] += cpu
+
+    def preflight(self, url):
+        return self._timed('resolve', super().preflight, url)
+
+    def _download(self, *args, **kwargs):
+        return self._timed('download', super()._download, *args, **kwargs)
+
+    def _probe_file(self, *args, **kwargs):
+        return self._timed('probe', super()._probe_file, *args, **kwargs)
+
+    def _process(self, *args, **kwargs):
+        self.encodes += 1
+        return self._timed('encode', super()._process, *args, **kwargs)
+
+def run_job(base_url: str, name: str, scratch: str) -> dict:
+    source, options = JOBS[name]
+    ext = SOURCES[source][4]
+    work_dir = tempfile.mkdtemp(prefix=f"{name}_", dir=scratch)
+    downloader = InstrumentedDownloader(download_dir=work_dir)
+    job = VideoJob(url=f"{base_url}/{source}.{ext}", **options)
+
+    wall, cpu = time.perf_counter(), _cpu_seconds()
+    with Sampler(work_dir) as sampler:
+        job.source_info = downloader.preflight(job.url)
+        output_path = downloader.run_job(job)
+    result = {
+        'wall': time.perf_counter() - wall,
+        'cpu': _cpu_seconds() - cpu,
+        'peak_rss_mb': sampler.peak_rss_kb / 1024,
+        'peak_scratch_mb': sampler.peak_scratch / (1024 * 1024),
+        'encodes': downloader.encodes,
+        'output_mb': os.path.getsize(output_path) / (1024 * 1024),
+        'stages': {stage: dict(values) for stage, values in downloader.stages.items()},
+    }
+    shutil.rmtree(work_dir, ignore_errors=True)
+    return result
+
+def _median(runs: list) -> dict:
+    merged = {key: statistics.median(r[key] for r in runs) for key in runs[0] if key != 'stages'}
+    merged['stages'] = {
+        stage: {k: statistics.median(r['stages'].get(stage, {}).get(k, 0.0) for r in runs) for k in ('wall', 'cpu')}
+        for stage in runs[0]['stages']
+    }
+    return merged
+
+def report(results: dict):
+    print(f"{'job':<14}{'wall s':>8}{'cpu s':>8}{'rss MB':>8}{'scratch MB':>11}{'encodes':>8}{'out MB':>8}  stages (wall s)")
+    for name, r in results.items():
+        stages = " ".join(f"{stage}={v['wall']:.2f}" for stage, v in r['stages'].items())
+        print(f"{name:<14}{r['wall']:>8.2f}{r['cpu']:>8.2f}{r['peak_rss_mb']:>8.0f}"
+              f"{r['peak_scratch_mb']:>11.1f}{r['encodes']:>8.0f}{r['output_mb']:>8.2f}  {stages}")
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for name, r in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for metric in COMPARED:
+            # Ignore noise on tiny values
+            if base[metric] > 0.05 and r[metric] > base[metric] * (1 + tolerance):
+                regressions.append(f"{name}.{metric}: {base[metric]:.2f} -> {r[metric]:.2f}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sources', default=os.path.join(tempfile.gettempdir(), "videodownloader-bench"),
+                        help="folder for generated sources (reused between runs)")
+    parser.add_argument('--jobs', nargs='*', default=list(JOBS), choices=list(JOBS))
+    parser.add_argument('--repeat', type=int, default=3, help="runs per job; the median is reported")
+    parser.add_argument('--baseline', default=None, help="baseline JSON to compare against")
+    parser.add_argument('--save-baseline', nargs='?', const=DEFAULT_BASELINE, default=None,
+                        help="write results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.15, help="allowed slowdown before flagging")
+    args = parser.parse_args()
+
+    generate_sources(args.sources)
+    server = serve(args.sources)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    scratch = tempfile.mkdtemp(prefix="bench_scratch_")
+    try:
+        results = {name: _median([run_job(base_url, name, scratch) for _ in range(args.repeat)]) for name in args.jobs}
+    finally:
+        server.shutdown()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    report(results)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline written to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
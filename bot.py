@@ -0,0 +1,413 @@
+from discord.ext import commands, tasks
+import discord
+import os
+import logging
+import asyncio
+import dataclasses
+import time
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from lib.download import VideoDownloader, VideoJob, JobControl, SESSIONS
+from lib.cache import ResultCache
+from lib.scheduler import JobScheduler
+from lib.workers import WorkerPool, WorkerCrashed, JobTimeout
+from lib.pipeline import StagedPipeline
+from lib.preflight import InfoCache
+from lib.storage import StorageManager
+from lib.coalesce import InFlight
+from lib.quality import QualityController
+from lib.journal import JobJournal, JournalEntry
+from lib.metrics import REGISTRY, STAGE_SECONDS, JobTrace
+from lib.validate import validate_url, validate_format, validate_times, validate_resolution, validate_framerate
+from lib.utils import (
+    remove_file, extract_arguments, seconds_to_hhmmss, DOWNLOAD_FOLDER,
+    CACHE_FOLDER, CACHE_MAX_BYTES, CACHE_SPILL_FOLDER, CACHE_SPILL_MAX_BYTES, CACHE_TTL,
+    SCHEDULER_CPUS, SCHEDULER_RAM_MB, SCHEDULER_CPU_OVERCOMMIT,
+    STORAGE_TMPFS_MB, STORAGE_SPILL_FOLDER, STORAGE_SPILL_MB, STORAGE_WAIT, STORAGE_POLL_INTERVAL, ORPHAN_MIN_AGE, SOURCE_FOLDER,
+    WORKER_COUNT, FETCH_WORKER_COUNT, HANDOFF_SLOTS, WORKER_MEMORY_MB, WORKER_CPU_SECONDS, WORKER_JOB_TIMEOUT, PREFLIGHT_TTL,
+    METRICS_HOST, METRICS_PORT, PROGRESS_INTERVAL, LATENCY_TARGET, JOURNAL_PATH, JOURNAL_MAX_ATTEMPTS, JobCancelled,
+    VideoSourceTooLarge, VideoOutputTooLarge # Import new errors
+)
+from dotenv import load_dotenv
+
+# ... [Keep Logging and Setup code same as before] ...
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler(),
+        logging.FileHandler("bot.log", encoding='utf-8')
+    ]
+)
+
+load_dotenv()
+DISCORD_BOT_TOKEN = os.getenv("DISCORD_BOT_TOKEN")
+bot = commands.Bot(command_prefix='!', intents=discord.Intents.all())
+
+result_cache = ResultCache(
+    tiers=[(CACHE_FOLDER, CACHE_MAX_BYTES), (CACHE_SPILL_FOLDER, CACHE_SPILL_MAX_BYTES)],
+    ttl=CACHE_TTL
+)
+info_cache = InfoCache(ttl=PREFLIGHT_TTL)
+storage = StorageManager(
+    tiers=[(DOWNLOAD_FOLDER, STORAGE_TMPFS_MB * 1024 * 1024), (STORAGE_SPILL_FOLDER, STORAGE_SPILL_MB * 1024 * 1024)],
+    wait=STORAGE_WAIT, poll_interval=STORAGE_POLL_INTERVAL, untracked=[SOURCE_FOLDER]
+)
+# Scratch space can spill to disk, so the scheduler may admit jobs against both tiers
+scheduler = JobScheduler(
+    cpus=SCHEDULER_CPUS * SCHEDULER_CPU_OVERCOMMIT, ram_mb=SCHEDULER_RAM_MB,
+    tmpfs_mb=STORAGE_TMPFS_MB + (STORAGE_SPILL_MB if STORAGE_SPILL_FOLDER else 0)
+)
+# Each admitted job blocks a thread for its whole run; giving them their own executor,
+# sized to the most jobs the scheduler can admit, keeps the default one free for new requests
+job_executor = ThreadPoolExecutor(max_workers=scheduler.capacity.cpus, thread_name_prefix="job")
+inflight = InFlight()
+quality = QualityController(latency_target=LATENCY_TARGET, encoders=WORKER_COUNT)
+# Accepted jobs survive a restart; unfinished ones are requeued from here in on_ready
+journal = JobJournal(JOURNAL_PATH)
+journal_replayed = False
+# Author id -> tasks of their download commands still running, for !cancel
+user_requests = {}
+# Downloads and encodes run in separate pools, so one job can download while another encodes
+pipeline = StagedPipeline(
+    fetch_pool=WorkerPool(
+        size=FETCH_WORKER_COUNT, download_dir=DOWNLOAD_FOLDER, memory_mb=WORKER_MEMORY_MB,
+        cpu_seconds=WORKER_CPU_SECONDS, timeout=WORKER_JOB_TIMEOUT, name="fetch"
+    ),
+    encode_pool=WorkerPool(
+        size=WORKER_COUNT, download_dir=DOWNLOAD_FOLDER, memory_mb=WORKER_MEMORY_MB,
+        cpu_seconds=WORKER_CPU_SECONDS, timeout=WORKER_JOB_TIMEOUT, name="encode"
+    ),
+    handoff_size=HANDOFF_SLOTS,
+    journal=journal
+)
+
+REGISTRY.gauge("videobot_queue_depth", "Jobs waiting for resources.", lambda: scheduler.stats()['queued'])
+REGISTRY.gauge("videobot_jobs_running", "Jobs currently admitted.", lambda: scheduler.stats()['running'])
+REGISTRY.gauge("videobot_queue_avg_wait_seconds", "Average queue wait.", lambda: scheduler.stats()['avg_wait'])
+REGISTRY.gauge("videobot_cache_hits", "Result cache hits.", lambda: result_cache.stats()['hits'])
+REGISTRY.gauge("videobot_cache_misses", "Result cache misses.", lambda: result_cache.stats()['misses'])
+REGISTRY.gauge("videobot_requests_coalesced", "Requests served by an identical in-flight job.",
+               lambda: inflight.coalesced)
+REGISTRY.gauge("videobot_worker_respawns", "Workers replaced after a crash or timeout.",
+               lambda: pipeline.fetch_pool.respawns + pipeline.encode_pool.respawns)
+REGISTRY.gauge("videobot_fetch_utilization", "Busy fraction of the fetch pool.", pipeline.fetch_pool.utilization)
+REGISTRY.gauge("videobot_encode_utilization", "Busy fraction of the encode pool.", pipeline.encode_pool.utilization)
+REGISTRY.gauge("videobot_handoff_waiting", "Fetched jobs waiting for an encoder.",
+               lambda: pipeline.stats()['handoff_waiting'])
+REGISTRY.gauge("videobot_journal_jobs", "Accepted jobs not yet finished.", lambda: sum(journal.stats().values()))
+REGISTRY.gauge("videobot_ydl_sessions_reused", "Preflights served by a warm YoutubeDL session.",
+               lambda: SESSIONS.stats()['reused'])
+
+# ... [Keep scheduled_restart, on_ready, ping, guide same as before] ...
+
+@tasks.loop(minutes=10)
+async def sweep_storage():
+    await asyncio.to_thread(storage.sweep_orphans, ORPHAN_MIN_AGE, journal.job_ids())
+
+class ResumedContext:
+    """Stands in for the command context of a journaled job requeued after a restart."""
+    def __init__(self, channel, author_id: int):
+        self.channel = channel
+        self.guild = getattr(channel, 'guild', None)
+        self.author = discord.Object(id=author_id)
+
+    async def send(self, *args, **kwargs):
+        return await self.channel.send(*args, **kwargs)
+
+async def replay_journal():
+    """Requeues the jobs a restart interrupted, in the order they were accepted."""
+    for entry in journal.unfinished():
+        try:
+            channel = bot.get_channel(entry.channel_id) or await bot.fetch_channel(entry.channel_id)
+        except discord.DiscordException as e:
+            logging.warning(f"Dropping journaled job {entry.job_id}, its channel is gone: {e}")
+            journal.finish(entry.job_id)
+            continue
+        if entry.attempts >= JOURNAL_MAX_ATTEMPTS:
+            logging.warning(f"Dropping journaled job {entry.job_id} after {entry.attempts} restarts.")
+            journal.finish(entry.job_id)
+            await channel.send(f"❌ <@{entry.author_id}> your download was interrupted too many times, please try again.")
+            continue
+        journal.requeued(entry.job_id)
+        logging.info(f"Requeuing journaled job {entry.job_id} (stage {entry.stage}).")
+        ctx = ResumedContext(channel, entry.author_id)
+        await ctx.send(f"♻️ <@{entry.author_id}> the bot restarted, resuming your download...")
+        asyncio.create_task(run_download(ctx, entry.args, entry))
+
+@bot.event
+async def on_ready():
+    if not sweep_storage.is_running():
+        sweep_storage.start()
+    # yt-dlp is imported here rather than at startup, so the gateway connects first
+    await asyncio.to_thread(SESSIONS.prewarm, 'resolve')
+    # on_ready fires again after every reconnect
+    global journal_replayed
+    if not journal_replayed:
+        journal_replayed = True
+        await replay_journal()
+
+async def send_file(ctx, file_name):
+    logging.info(f"Attempting to send file: {file_name}")
+    # ... [Keep existing assertions] ...
+    
+    with open(file_name, 'rb') as file:
+        await ctx.send(file=discord.File(file, file_name))
+    logging.info(f"File sent successfully: {file_name}")
+
+async def handle_download(ctx, args, resumed: Optional[JournalEntry] = None):
+    url, options = extract_arguments(args)
+
+    validate_url(url)
+    format = options['format'].lower()
+    validate_format(format)
+
+    start = float(options['start']) if options['start'] else None
+    end = float(options['end']) if options['end'] else None
+    validate_times(start, end)
+
+    resolution = options['resolution']
+    resolution_tuple = tuple(map(int, resolution.split('x'))) if resolution else None
+    validate_resolution(resolution)
+
+    framerate = int(options['framerate']) if options['framerate'] else None
+    validate_framerate(framerate)
+
+    trace = JobTrace()
+    trace.set('format', format)
+    progress = {}
+    def on_progress(stage, fraction):
+        # Called from the job's thread; the status loop below picks it up
+        progress['latest'] = (stage, fraction)
+    control = JobControl(on_progress=on_progress)
+    downloader = VideoDownloader(download_dir=DOWNLOAD_FOLDER, cache=result_cache, pipeline=pipeline.run,
+                                 info_cache=info_cache, trace=trace, control=control)
+    job = VideoJob(
+            url=url,
+            format=format,
+            start_time=seconds_to_hhmmss(start),
+            end_time=seconds_to_hhmmss(end),
+            width=resolution_tuple[0] if resolution_tuple else None,
+            height=resolution_tuple[1] if resolution_tuple else None,
+            framerate=framerate,
+            # A requeued job keeps its id, and with it the names of its partial files
+            output_name=resumed.job_id if resumed else None,
+            source_dir=SOURCE_FOLDER or None
+    )
+    trace.job_id = job.output_name
+
+    # Resolve metadata once; oversized sources are rejected before any bytes are fetched
+    meta = await asyncio.to_thread(downloader.probe_source, job)
+    try:
+        downloader.validate_source(job, meta)
+    except VideoSourceTooLarge:
+        trace.publish('rejected')
+        raise
+    job.source_info = info_cache.get(url)
+    cost = downloader.estimate_cost(job, meta)
+    job.threads = cost.cpus
+    owner = (ctx.guild.id if ctx.guild else None, ctx.author.id)
+
+    status = None
+    async def show(text):
+        nonlocal status
+        if status is None:
+            status = await ctx.send(text)
+        else:
+            await status.edit(content=text)
+
+    async def on_position(position):
+        await show(f"⏳ Queued at position {position}... (`!cancel` to stop)")
+
+    async def show_progress():
+        shown = None
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            latest = progress.get('latest')
+            if latest and latest != shown:
+                stage, fraction = latest
+                label = "⬇️ Downloading" if stage == 'download' else "⚙️ Processing"
+                await show(f"{label}{f' {fraction:.0%}' if fraction is not None else '...'}")
+                shown = latest
+
+    key = await asyncio.to_thread(downloader.job_key, job)
+    # A cached result needs no queue slot, scratch space or worker
+    cached = result_cache.get(key)
+    trace.set('cache', 'hit' if cached else 'miss')
+    if cached:
+        outcome = 'error'
+        try:
+            trace.set('bytes_out', os.path.getsize(cached))
+            with trace.span('upload'):
+                await send_file(ctx, cached)
+            outcome = 'ok'
+        except (asyncio.CancelledError, JobCancelled):
+            outcome = 'cancelled'
+            raise
+        finally:
+            result_cache.release(cached)
+            trace.publish(outcome)
+        return cached
+
+    if key in inflight:
+        trace.set('coalesced', True)
+        await ctx.send("⏳ Someone already requested this, sharing their result...")
+
+    admitted = False
+    async def launch():
+        queued = time.perf_counter()
+        async def process():
+            nonlocal admitted
+            admitted = True
+            loop = asyncio.get_running_loop()
+            trace.spans.append(('queue', time.perf_counter() - queued))
+            # Reserve scratch space first; this waits or spills instead of hitting ENOSPC
+            with trace.span('storage'):
+                job.work_dir = await loop.run_in_executor(
+                    job_executor, storage.reserve, job.output_name, cost.tmpfs_mb * 1024 * 1024
+                )
+            control.check()
+            journal.update(job.output_name, 'running')
+            # Encoder settings follow the load at the moment the job starts
+            level = quality.choose(format, (end or meta['duration'] or 0) - (start or 0), scheduler.stats()['queued'])
+            if level:
+                job.preset, job.gif_dither = level.preset, level.gif_dither
+                trace.set('preset', level.preset)
+                trace.set('gif_dither', level.gif_dither)
+            await show("Downloading and processing media... (`!cancel` to stop)")
+            logging.info("Downloading with parsed options: %s", options)
+            updater = asyncio.create_task(show_progress())
+            try:
+                # Run the blocking download/process in a thread
+                file_name = await loop.run_in_executor(job_executor, functools.partial(downloader.run_job, job, lookup=False))
+            finally:
+                updater.cancel()
+            # The preset speed factors describe single-pass x264 only: GIFs and segmented encodes would skew them
+            if trace.values.get('mode') == 'encode' and 'segments' not in trace.values:
+                quality.observe(format, job.preset, trace.values.get('ffmpeg_speed'))
+            return file_name
+        return await scheduler.run(owner, cost, process, on_position)
+
+    def abandon(task):
+        # Nobody is waiting for the result any more: kill the work, or leave the queue
+        control.cancel()
+        if not admitted:
+            task.cancel()
+
+    def cleanup(file_name):
+        # Runs after the last requester sharing this job is done; cached results stay on disk
+        if file_name and not result_cache.release(file_name):
+            remove_file(file_name)
+            logging.info("Temporary file removed (or attempted): %s", file_name)
+        storage.release(job.output_name)
+
+    journal.record(job.output_name, args, ctx.channel.id, owner[0], ctx.author.id, dataclasses.asdict(job))
+    file_name = None
+    outcome = 'error'
+    try:
+        async with inflight.attach(key, launch, cleanup, abandon) as file_name:
+            if not os.path.exists(file_name):
+                 raise FileNotFoundError("Processing failed, file was not created.")
+
+            trace.set('bytes_out', os.path.getsize(file_name))
+            with trace.span('upload'):
+                await send_file(ctx, file_name)
+        outcome = 'ok'
+    except (asyncio.CancelledError, JobCancelled):
+        outcome = 'cancelled'
+        raise
+    finally:
+        trace.publish(outcome)
+        # A job cut short by shutdown stays journaled and is requeued on the next start
+        if outcome != 'cancelled' or not bot.is_closed():
+            journal.finish(job.output_name)
+
+    return file_name
+
+@bot.command()
+async def download(ctx, *, args):
+    logging.info("Download command received with arguments: %s", args)
+    await run_download(ctx, args)
+
+async def run_download(ctx, args, resumed: Optional[JournalEntry] = None):
+    task = asyncio.current_task()
+    user_requests.setdefault(ctx.author.id, set()).add(task)
+    try:
+        await handle_download(ctx, args, resumed)
+
+    except (asyncio.CancelledError, JobCancelled):
+        await ctx.send("🛑 Download cancelled.")
+        logging.info("Download cancelled by %s", ctx.author.id)
+        
+    except VideoSourceTooLarge:
+        await ctx.send("❌ Error 1001: Video attempting to download is too big.")
+        logging.warning("Handled Error 1001: Source too large.")
+
+    except VideoOutputTooLarge:
+        await ctx.send("❌ Error 1002: Processed video is above 10MB.")
+        logging.warning("Handled Error 1002: Output too large.")
+
+    except (WorkerCrashed, JobTimeout) as e:
+        await ctx.send(f"❌ Processing was stopped: {str(e)}")
+        logging.warning("Worker failure: %s", e)
+
+    except Exception as e:
+        logging.exception("Error during download:")
+        
+        # The failing worker already removed its files; the bot keeps running
+        error_str = str(e).lower()
+        if "no space left" in error_str or (hasattr(e, 'errno') and e.errno == 28):
+            await ctx.send("❌ Storage is temporarily full, please try again shortly.")
+            return
+
+        await ctx.send(f"❌ An error occurred: {str(e)}")
+
+    finally:
+        user_requests[ctx.author.id].discard(task)
+        # A requeued job that failed before it was accepted again must not come back
+        if resumed and not bot.is_closed():
+            journal.finish(resumed.job_id)
+
+@bot.command()
+async def cancel(ctx):
+    tasks = [t for t in user_requests.get(ctx.author.id, ()) if not t.done()]
+    if not tasks:
+        await ctx.send("Nothing to cancel.")
+        return
+    # Each request detaches from its job; a job nobody else shares is stopped
+    for task in tasks:
+        task.cancel()
+
+@bot.command()
+async def queue(ctx):
+    stats = scheduler.stats()
+    await ctx.send(
+        f"📋 {stats['queued']} queued, {stats['running']} running. "
+        f"Average wait {stats['avg_wait']:.1f}s, longest current wait {stats['oldest_wait']:.1f}s."
+    )
+
+@bot.command()
+async def stats(ctx):
+    lines = ["📊 Stage timings (p50 / p95):"]
+    for stage in STAGE_SECONDS.label_values('stage'):
+        p50, p95 = STAGE_SECONDS.quantile(0.5, stage=stage), STAGE_SECONDS.quantile(0.95, stage=stage)
+        lines.append(f"`{stage:<16}` {p50:.2f}s / {p95:.2f}s")
+    queue_stats, cache_stats = scheduler.stats(), result_cache.stats()
+    lines.append(f"Queue: {queue_stats['queued']} waiting, {queue_stats['running']} running, "
+                 f"average wait {queue_stats['avg_wait']:.1f}s")
+    stage_stats = pipeline.stats()
+    lines.append(f"Pipeline: fetch {stage_stats['fetch']['utilization']:.0%} busy, "
+                 f"encode {stage_stats['encode']['utilization']:.0%} busy, "
+                 f"{stage_stats['handoff_waiting']}/{stage_stats['handoff_size']} waiting for an encoder")
+    speeds = quality.stats()
+    lines.append(f"Encode speed at the fast preset: mp4 {speeds['mp4']}x, gif {speeds['gif']}x")
+    lines.append(f"Cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, {cache_stats['entries']} entries")
+    await ctx.send("\n".join(lines))
+
+def main():
+    storage.sweep_orphans(keep=journal.job_ids())
+    if METRICS_PORT:
+        REGISTRY.serve(METRICS_HOST, METRICS_PORT)
+    pipeline.start()
+    bot.run(DISCORD_BOT_TOKEN)
\ No newline at end of file
@@ -0,0 +1,153 @@
+import os
+import time
+import shutil
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, List, Tuple
+
+@dataclass
+class CacheEntry:
+    path: str
+    size: int
+    created: float
+    tier: int = 0
+    pins: int = 0
+
+def make_cache_key(video_id: str, format: str, start: Optional[float], end: Optional[float],
+                   width: Optional[int], height: Optional[int], framerate: Optional[int]) -> str:
+    """Hashes the canonical video id and the normalized job options."""
+    raw = "|".join(str(p) for p in (
+        video_id, format.lower(),
+        float(start) if start else 0.0, float(end) if end is not None else None,
+        width or None, height or None, framerate or None,
+    ))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+class ResultCache:
+    """
+    Size-bounded cache of processed outputs.
+
+    Tiers are (folder, byte budget) pairs, fastest first. Entries evicted from a
+    tier move down to the next one when it exists and are deleted otherwise.
+    Entries older than `ttl` seconds are dropped. Files handed out by `get`/`put`
+    are pinned until `release` so they are never evicted mid-upload.
+    """
+    def __init__(self, tiers: List[Tuple[str, int]], ttl: float):
+        self.tiers = [(folder, budget) for folder, budget in tiers if folder]
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        for tier, (folder, _) in enumerate(self.tiers):
+            os.makedirs(folder, exist_ok=True)
+            self._adopt(folder, tier)
+
+    def _adopt(self, folder: str, tier: int):
+        """Re-indexes files left over from a previous run, oldest first."""
+        found = []
+        for name in os.listdir(folder):
+            path = os.path.join(folder, name)
+            key, _ = os.path.splitext(name)
+            if os.path.isfile(path) and key not in self._entries:
+                stat = os.stat(path)
+                found.append((stat.st_mtime, key, CacheEntry(path, stat.st_size, stat.st_mtime, tier)))
+        for _, key, entry in sorted(found):
+            self._entries[key] = entry
+
+    def _tier_usage(self, tier: int) -> int:
+        return sum(e.size for e in self._entries.values() if e.tier == tier)
+
+    def _drop(self, key: str):
+        entry = self._entries.pop(key)
+        if os.path.exists(entry.path):
+            os.remove(entry.path)
+        self.evictions += 1
+
+    def _expire(self):
+        now = time.time()
+        for key in [k for k, e in self._entries.items() if e.pins == 0 and now - e.created > self.ttl]:
+            logging.info(f"Cache entry {key} expired.")
+            self._drop(key)
+
+    def _make_room(self, tier: int, needed: int) -> bool:
+        _, budget = self.tiers[tier]
+        if needed > budget:
+            return False
+        # OrderedDict iterates least recently used first
+        for key in list(self._entries):
+            if self._tier_usage(tier) + needed <= budget:
+                break
+            entry = self._entries[key]
+            if entry.tier != tier or entry.pins:
+                continue
+            if tier + 1 < len(self.tiers) and self._make_room(tier + 1, entry.size):
+                folder, _ = self.tiers[tier + 1]
+                new_path = os.path.join(folder, os.path.basename(entry.path))
+                shutil.move(entry.path, new_path)
+                entry.path, entry.tier = new_path, tier + 1
+                logging.info(f"Cache entry {key} spilled to tier {entry.tier}.")
+            else:
+                self._drop(key)
+        return self._tier_usage(tier) + needed <= budget
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns a pinned path for `key`, or None on a miss."""
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(key)
+            if entry is None or not os.path.exists(entry.path):
+                self._entries.pop(key, None)
+                self.misses += 1
+                logging.info(f"Cache miss {key} ({self.stats()})")
+                return None
+            self._entries.move_to_end(key)
+            entry.pins += 1
+            self.hits += 1
+            logging.info(f"Cache hit {key} ({self.stats()})")
+            return entry.path
+
+    def put(self, key: str, file_path: str) -> str:
+        """
+        Moves `file_path` into the cache and returns the pinned cached path.
+        Files that fit no tier are returned unchanged and stay owned by the caller.
+        """
+        size = os.path.getsize(file_path)
+        _, ext = os.path.splitext(file_path)
+        with self._lock:
+            self._expire()
+            if key in self._entries:
+                if self._entries[key].pins:
+                    # An identical result is being delivered right now; keep that one
+                    return file_path
+                self._drop(key)
+            for tier, (folder, _) in enumerate(self.tiers):
+                if self._make_room(tier, size):
+                    cached_path = os.path.join(folder, f"{key}{ext}")
+                    shutil.move(file_path, cached_path)
+                    self._entries[key] = CacheEntry(cached_path, size, time.time(), tier, pins=1)
+                    return cached_path
+        logging.info(f"Result of {size} bytes does not fit the cache; not stored.")
+        return file_path
+
+    def release(self, file_path: str) -> bool:
+        """Unpins a path handed out by the cache. Returns False if the cache does not own it."""
+        with self._lock:
+            for entry in self._entries.values():
+                if entry.path == file_path:
+                    entry.pins = max(0, entry.pins - 1)
+                    return True
+        return False
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'bytes': sum(e.size for e in self._entries.values()),
+        }
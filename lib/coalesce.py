@@ -0,0 +1,69 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+@dataclass(eq=False)
+class _Shared:
+    task: asyncio.Future
+    cleanup: Callable[[Optional[Any]], None]
+    abandon: Optional[Callable[[asyncio.Future], None]] = None
+    refs: int = 0
+
+class InFlight:
+    """
+    Shares one running job between identical requests.
+
+    The first request for a key starts the job; later requests for the same key
+    attach to it while it runs or is being delivered and receive the same result.
+    `cleanup` runs once, after the last attached request has finished with it.
+    If every request leaves before the job finishes, `abandon` is called with the
+    job's task so the work can be stopped.
+    """
+    def __init__(self):
+        self.coalesced = 0
+        self._jobs: Dict[Hashable, _Shared] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._jobs
+
+    @asynccontextmanager
+    async def attach(self, key: Hashable, start: Callable[[], Awaitable[Any]],
+                     cleanup: Callable[[Optional[Any]], None],
+                     abandon: Optional[Callable[[asyncio.Future], None]] = None):
+        """Yields the shared job's result, starting the job if nothing is running for `key`."""
+        shared = self._jobs.get(key)
+        if shared is None:
+            shared = self._jobs[key] = _Shared(asyncio.ensure_future(start()), cleanup, abandon)
+        else:
+            self.coalesced += 1
+            logging.info(f"Attached to in-flight job {key} ({shared.refs} already waiting)")
+        shared.refs += 1
+        try:
+            # Shielded, so one requester going away does not cancel the job for the others
+            yield await asyncio.shield(shared.task)
+        finally:
+            shared.refs -= 1
+            if shared.refs == 0:
+                del self._jobs[key]
+                if shared.task.done():
+                    self._cleanup(shared)
+                else:
+                    # Everyone left early; stop the job and tidy up once it has finished
+                    shared.task.add_done_callback(lambda _: self._cleanup(shared))
+                    if shared.abandon:
+                        shared.abandon(shared.task)
+
+    @staticmethod
+    def _cleanup(shared: _Shared):
+        task = shared.task
+        result = task.result() if not task.cancelled() and task.exception() is None else None
+        shared.cleanup(result)
+
+    def stats(self) -> dict:
+        return {
+            'jobs': len(self._jobs),
+            'waiting': sum(s.refs for s in self._jobs.values()),
+            'coalesced': self.coalesced,
+        }
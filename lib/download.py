@@ -2,19 +2,30 @@ import os
 import subprocess
 import math
 import logging
+import time
+import threading
 import json
-from dataclasses import dataclass
-from typing import Optional, Tuple
-import yt_dlp
-from datetime import datetime
+import copy
+import dataclasses
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Optional, Tuple, List, Callable, BinaryIO, Dict
 from uuid import uuid4
-from lib.utils import VideoSourceTooLarge, VideoOutputTooLarge, MAX_SIZE_MB, SAFE_GIF_WIDTH, SAFE_GIF_FPS, MAX_GIF_LENGTH
-
-def get_timestamp():
-    now = datetime.now()
-    midnight = datetime.combine(now.date(), datetime.min.time())
-    elapsed = now - midnight
-    return int(elapsed.total_seconds() * 1000)
+from lib.utils import (
+    VideoSourceTooLarge, VideoOutputTooLarge, MAX_SIZE_MB, SAFE_GIF_WIDTH, SAFE_GIF_FPS, MAX_GIF_LENGTH, MAX_GIF_FRAMES,
+    MAX_ENCODE_ATTEMPTS, JOB_PREFIX, remove_file, MAX_SOURCE_MB, SOURCE_FORMAT, STREAM_PEEK_BYTES, MAX_RANGED_SECONDS, RANGE_KEYFRAME_MARGIN, hhmmss_to_seconds, seconds_to_hhmmss,
+    JobCancelled, X264_PRESET, AUDIO_BITRATE_KBPS, GIF_SAMPLE_COUNT, GIF_SAMPLE_SECONDS, SEGMENT_MIN_CLIP, SEGMENT_MIN_LENGTH, MAX_SEGMENTS,
+    YDL_IDLE_SESSIONS
+)
+from lib.encode import EncodePlan, plan_encode, plan_copy, size_budget_kbits
+from lib.cache import ResultCache, make_cache_key
+from lib.gif import GifPalette, GIF_WIDTHS, gif_command, gif_height, gif_palettes, plan_gif
+from lib.preflight import InfoCache, summarize, video_id
+from lib.formats import FormatChoice, select_source
+from lib.stream import is_streamable, run_ffmpeg, run_tracked
+from lib.segments import split_segments, encode_segments
+from lib.metrics import JobTrace
+from lib.scheduler import JobCost, estimate_cost
 
 @dataclass
 class VideoJob:
@@ -26,59 +37,373 @@ class VideoJob:
     height: Optional[int] = None
     framerate: Optional[int] = None
     output_name: Optional[str] = None
+    threads: Optional[int] = None
+    preset: Optional[str] = None      # libx264 preset, chosen per job by lib.quality
+    gif_dither: Optional[str] = None  # preferred paletteuse dither, likewise
+    source_info: Optional[dict] = field(default=None, repr=False)  # preflight extract_info result
+    work_dir: Optional[str] = None  # scratch folder reserved for the job; defaults to download_dir
+    source_dir: Optional[str] = None  # where the source is downloaded; defaults to work_dir
     
     def __post_init__(self):
         if not self.output_name:
-            self.output_name = f"job_{uuid4().hex}"
+            self.output_name = f"{JOB_PREFIX}{uuid4().hex}"
+
+@dataclass
+class FetchedSource:
+    """A downloaded source waiting for the encode stage."""
+    path: str
+    width: int
+    height: int
+
+class JobControl:
+    """
+    Cancel token and progress sink for one job.
+
+    `cancel()` may be called from any thread: it flags the job and kills the
+    ffmpeg processes it is running; the job's stages raise JobCancelled at their
+    next check. Inside a worker process the flag is a multiprocessing Event that
+    WorkerPool sets. Progress reports are rate limited to one per `min_interval`
+    seconds per stage.
+    """
+    def __init__(self, on_progress: Optional[Callable[[str, Optional[float]], None]] = None,
+                 cancel_event=None, min_interval: float = 0.5):
+        self.on_progress = on_progress
+        self.min_interval = min_interval
+        self._event = cancel_event or threading.Event()
+        self._procs = []
+        self._lock = threading.Lock()
+        self._report_lock = threading.Lock()
+        self._last = (None, 0.0)
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        self._event.set()
+        with self._lock:
+            procs = list(self._procs)
+        for proc in procs:
+            if proc.poll() is None:
+                proc.kill()
+
+    def check(self):
+        if self.cancelled:
+            raise JobCancelled("Job was cancelled.")
+
+    def track(self, proc: subprocess.Popen):
+        with self._lock:
+            self._procs = [p for p in self._procs if p.poll() is None] + [proc]
+        if self.cancelled:
+            proc.kill()
+
+    def report(self, stage: str, fraction: Optional[float] = None):
+        # Serialized: segment encoders report from several threads
+        with self._report_lock:
+            now = time.monotonic()
+            last_stage, last_time = self._last
+            if stage == last_stage and now - last_time < self.min_interval:
+                return
+            self._last = (stage, now)
+            if self.on_progress:
+                self.on_progress(stage, fraction)
+
+yt_dlp = None  # Imported on first use, see load_yt_dlp
+
+def load_yt_dlp():
+    """Imports yt-dlp once per process; it is slow to import and only needed once a job arrives."""
+    global yt_dlp
+    if yt_dlp is None:
+        import yt_dlp as module
+        yt_dlp = module
+    return yt_dlp
+
+_MISSING = object()  # Marks an option the base profile does not set
+
+class YDLSession:
+    """
+    A long-lived YoutubeDL. Its extractor instances, cookies and HTTP connection
+    pool outlive the job, while `use()` applies per-job options on top of the
+    base options and restores them afterwards.
+    """
+    def __init__(self, base_opts: dict):
+        self.ydl = load_yt_dlp().YoutubeDL(dict(base_opts))
+        self.jobs = 0
+
+    def _apply(self, key: str, value):
+        params = self.ydl.params
+        if value is _MISSING:
+            params.pop(key, None)
+        else:
+            params[key] = value
+        # YoutubeDL derives these two from its params once, in __init__
+        if key == 'outtmpl':
+            if params.get('outtmpl') is not None and not isinstance(params['outtmpl'], dict):
+                params['outtmpl'] = {'default': params['outtmpl']}
+            self.ydl._parse_outtmpl()
+        elif key == 'format':
+            fmt = params.get('format')
+            self.ydl.format_selector = fmt if fmt in (None, '-') or callable(fmt) else self.ydl.build_format_selector(fmt)
+
+    @contextmanager
+    def use(self, opts: Optional[dict] = None):
+        opts = dict(opts or {})
+        hooks = opts.pop('progress_hooks', [])
+        params = self.ydl.params
+        saved = {key: copy.copy(params[key]) if key in params else _MISSING for key in opts}
+        for key, value in opts.items():
+            self._apply(key, value)
+        for hook in hooks:
+            self.ydl.add_progress_hook(hook)
+        try:
+            yield self.ydl
+        finally:
+            for hook in hooks:
+                self.ydl._progress_hooks.remove(hook)
+            for key, value in saved.items():
+                self._apply(key, value)
+            self.jobs += 1
+
+    def close(self):
+        self.ydl.close()
+
+class YDLPool:
+    """
+    Warm YoutubeDL sessions keyed by option profile. A session serves one job at
+    a time; concurrent jobs get extra sessions, and up to `max_idle` per profile
+    are kept for the next job.
+    """
+    PROFILES = {
+        # Metadata only, in the bot process
+        'resolve': {'quiet': True, 'noplaylist': True, 'format': SOURCE_FORMAT},
+        # Source downloads and streamed reads, in worker processes
+        'download': {'quiet': True, 'noplaylist': True},
+    }
+
+    def __init__(self, max_idle: int = YDL_IDLE_SESSIONS):
+        self.max_idle = max_idle
+        self._idle: Dict[str, List[YDLSession]] = {profile: [] for profile in self.PROFILES}
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    @contextmanager
+    def session(self, profile: str, **opts):
+        """Checks out a session of `profile` with `opts` applied for the duration of the block."""
+        with self._lock:
+            session = self._idle[profile].pop() if self._idle[profile] else None
+            if session:
+                self.reused += 1
+        if session is None:
+            session = YDLSession(self.PROFILES[profile])
+            with self._lock:
+                self.created += 1
+        try:
+            with session.use(opts) as ydl:
+                yield ydl
+        finally:
+            with self._lock:
+                keep = len(self._idle[profile]) < self.max_idle
+                if keep:
+                    self._idle[profile].append(session)
+            if not keep:
+                session.close()
+
+    def prewarm(self, *profiles: str):
+        """Imports yt-dlp and opens one idle session per profile ahead of the first job."""
+        started = time.perf_counter()
+        for profile in profiles:
+            with self._lock:
+                if self._idle[profile]:
+                    continue
+            session = YDLSession(self.PROFILES[profile])
+            with self._lock:
+                self.created += 1
+                self._idle[profile].append(session)
+        logging.info(f"Prewarmed yt-dlp sessions ({', '.join(profiles)}) in {time.perf_counter() - started:.1f}s.")
+
+    def stats(self) -> dict:
+        with self._lock:
+            idle = {profile: len(sessions) for profile, sessions in self._idle.items()}
+        return {'idle': idle, 'created': self.created, 'reused': self.reused}
+
+    def close(self):
+        with self._lock:
+            sessions = [s for profile in self._idle.values() for s in profile]
+            self._idle = {profile: [] for profile in self.PROFILES}
+        for session in sessions:
+            session.close()
+
+SESSIONS = YDLPool()
 
 class VideoDownloader:
-    def __init__(self, download_dir: str = "./downloads"):
+    def __init__(self, download_dir: str = "./downloads", cache: Optional[ResultCache] = None,
+                 pipeline: Optional[Callable[[VideoJob, JobTrace, JobControl], str]] = None,
+                 info_cache: Optional[InfoCache] = None, trace: Optional[JobTrace] = None,
+                 control: Optional[JobControl] = None):
         self.download_dir = download_dir
+        self.cache = cache
+        self.info_cache = info_cache
+        self.trace = trace or JobTrace()
+        self.control = control or JobControl()
+        # Runs download+process for a job; defaults to this process, see lib.workers.WorkerPool.run
+        self.pipeline = pipeline or (lambda job, trace, control: self._run_pipeline(job))
         os.makedirs(self.download_dir, exist_ok=True)
 
-    def _get_output_path(self, base_name: str, format: str) -> str:
-        return os.path.join(self.download_dir, f"{base_name}_processed.{format}")
+    def _get_output_path(self, base_name: str, format: str, folder: Optional[str] = None) -> str:
+        return os.path.join(folder or self.download_dir, f"{base_name}_processed.{format}")
 
-    def _probe_file(self, file_path: str) -> dict:
-        """Uses ffprobe to extract width, height, and duration safely."""
+    def _probe_file(self, file_path: str, keyframes: bool = False) -> dict:
+        """
+        Uses ffprobe to extract dimensions, duration, codecs and bitrate safely.
+        With keyframes=True also lists video keyframe timestamps (packet scan, no decoding).
+        """
+        empty = {
+            'width': 0, 'height': 0, 'duration': 0, 'bitrate': 0,
+            'video_codec': None, 'audio_codec': None, 'pix_fmt': None, 'keyframes': []
+        }
         try:
             cmd = [
                 'ffprobe', '-v', 'quiet', '-print_format', 'json',
                 '-show_format', '-show_streams', file_path
             ]
-            result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-            data = json.loads(result.stdout)
+            with self.trace.span('probe'):
+                data = json.loads(self._run_tracked(cmd))
             
-            # Find the video stream
+            # Find the video and audio streams
             video = next((s for s in data.get('streams', []) if s['codec_type'] == 'video'), None)
+            audio = next((s for s in data.get('streams', []) if s['codec_type'] == 'audio'), None)
             fmt = data.get('format', {})
             
-            return {
+            meta = dict(empty)
+            meta.update({
                 'width': int(video.get('width', 0)) if video else 0,
                 'height': int(video.get('height', 0)) if video else 0,
-                'duration': float(fmt.get('duration', 0))
-            }
+                'duration': float(fmt.get('duration', 0)),
+                'bitrate': int(fmt.get('bit_rate', 0)),
+                'video_codec': video.get('codec_name') if video else None,
+                'audio_codec': audio.get('codec_name') if audio else None,
+                'pix_fmt': video.get('pix_fmt') if video else None,
+            })
+            if keyframes and video:
+                meta['keyframes'] = self._probe_keyframes(file_path)
+            return meta
+        except JobCancelled:
+            raise
         except Exception as e:
             logging.warning(f"Failed to probe file: {e}")
-            return {'width': 0, 'height': 0, 'duration': 0}
+            return empty
+
+    def _probe_keyframes(self, file_path: str) -> List[float]:
+        cmd = [
+            'ffprobe', '-v', 'quiet', '-select_streams', 'v:0',
+            '-show_entries', 'packet=pts_time,flags', '-of', 'csv=print_section=0', file_path
+        ]
+        with self.trace.span('probe_keyframes'):
+            output = self._run_tracked(cmd).decode()
+        keyframes = []
+        for line in output.splitlines():
+            pts, _, flags = line.partition(',')
+            if 'K' in flags and pts not in ('', 'N/A'):
+                keyframes.append(float(pts))
+        return sorted(keyframes)
+
+    def preflight(self, url: str) -> dict:
+        """
+        Metadata-only extract_info, cached by URL and video id. The result is
+        reused for validation, the result-cache key and the download itself.
+        """
+        if self.info_cache:
+            info = self.info_cache.get(url)
+            if info is not None:
+                return info
+        with self.trace.span('resolve'), SESSIONS.session('resolve') as ydl:
+            info = ydl.sanitize_info(ydl.extract_info(url, download=False))
+        if self.info_cache:
+            self.info_cache.put(url, info)
+        return info
+
+    def probe_source(self, job: VideoJob) -> dict:
+        """
+        Preflight summary used to validate and estimate a job before it is queued.
+        Returns id, duration, width, height and filesize (0 when unknown); filesize
+        is that of the source formats select_source would download.
+        """
+        try:
+            info = self.preflight(job.url)
+        except yt_dlp.utils.DownloadError as e:
+            logging.warning(f"Failed to probe source: {e}")
+            return {'id': None, 'duration': 0, 'width': 0, 'height': 0, 'filesize': 0}
+        meta = summarize(info, job.format)
+        choice = self.select_source(job, info)
+        if choice and choice.bytes:
+            meta['filesize'] = choice.bytes
+        return meta
+
+    def select_source(self, job: VideoJob, info: dict) -> Optional[FormatChoice]:
+        """Smallest source formats that still satisfy the job's output."""
+        clip_duration = self._clip_duration(job, float(info.get('duration') or 0))
+        return select_source(info, job.format, clip_duration, job.width, job.height)
+
+    def validate_source(self, job: VideoJob, meta: dict):
+        """Rejects a job whose download would exceed MAX_SOURCE_MB, before any bytes are fetched."""
+        expected = meta['filesize']
+        section = self._section(job)
+        if section and meta['duration']:
+            expected *= min((section[1] - section[0]) / meta['duration'], 1)
+        if expected > MAX_SOURCE_MB * 1024 * 1024:
+            raise VideoSourceTooLarge(
+                f"Source is about {expected / (1024 * 1024):.0f}MB, over the {MAX_SOURCE_MB}MB limit (Error 1001)"
+            )
+
+    def _resolve_id(self, url: str) -> str:
+        """Canonical "<extractor>:<id>" for a URL, so different links to one video share a key."""
+        try:
+            return video_id(self.preflight(url)) or url
+        except yt_dlp.utils.DownloadError as e:
+            logging.warning(f"Could not resolve video id, caching by URL: {e}")
+        return url
+
+    def job_key(self, job: VideoJob) -> str:
+        """Normalized key for a job's output, shared by the result cache and in-flight coalescing."""
+        return make_cache_key(
+            self._resolve_id(job.url), job.format,
+            hhmmss_to_seconds(job.start_time), hhmmss_to_seconds(job.end_time),
+            job.width, job.height, job.framerate
+        )
 
-    def _download(self, url: str, format: str, filename: Optional[str]) -> Tuple[str, int, int]:
-        # ... [Same download logic as previous step] ...
-        ydl_format = "bestvideo[ext=mp4][vcodec!*=av01]+bestaudio/best"
-        postprocessors = []
+    def _section(self, job: VideoJob) -> Optional[Tuple[float, float]]:
+        """Source range worth fetching for a trimmed job, or None to fetch everything."""
+        start = hhmmss_to_seconds(job.start_time) or 0
+        end = hhmmss_to_seconds(job.end_time)
+        if end is None or end - start > MAX_RANGED_SECONDS:
+            return None
+        if job.format == "gif":
+            end = min(end, start + MAX_GIF_LENGTH)
+        return max(start - RANGE_KEYFRAME_MARGIN, 0), end + RANGE_KEYFRAME_MARGIN
+
+    def _download(self, url: str, format: str, filename: Optional[str],
+                  section: Optional[Tuple[float, float]] = None,
+                  info: Optional[dict] = None, source_format: Optional[str] = None,
+                  folder: Optional[str] = None) -> Tuple[str, int, int, float]:
+        """
+        Downloads the source and returns (path, width, height, offset), where offset
+        is the source time in seconds at which the downloaded file begins.
+        With a section, only that range is fetched; extractors that cannot serve
+        ranges fall back to a full download. A preflight `info` skips resolving the page again,
+        and `source_format` overrides the default format selector.
+        """
+        # Sources keep their native container and codecs; the single ffmpeg pass in
+        # _process does all conversion, so there are no yt-dlp postprocessors here
+        ydl_format = "bestaudio" if format == "mp3" else SOURCE_FORMAT
 
-        if format == "mp3":
-            ydl_format = "bestaudio"
-            postprocessors.append({'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3'})
-        elif format in ("mp4", "gif"):
-            ydl_format = "bestvideo[ext=mp4][vcodec!*=av01]+bestaudio/best"
-            postprocessors.append({'key': 'FFmpegVideoConvertor', 'preferedformat': 'mp4'})
+        if source_format:
+            ydl_format = source_format
 
         filename_template = filename or '%(title)s'
-        outtmpl = os.path.join(self.download_dir, f'{filename_template}.%(ext)s')
+        outtmpl = os.path.join(folder or self.download_dir, f'{filename_template}.%(ext)s')
         
-        # 100MB limit for source file
-        max_dl_size = 100 * 1024 * 1024 
+        max_dl_size = MAX_SOURCE_MB * 1024 * 1024
 
         ydl_opts = {
             'format': ydl_format,
@@ -86,25 +411,106 @@ class VideoDownloader:
             'noplaylist': True,
             'quiet': True,
             'max_filesize': max_dl_size,
-            'merge_output_format': format if format in ("mp4", "mp3") else None,
-            'postprocessors': postprocessors,
         }
 
+        if section:
+            # The range itself bounds the download; a whole-file size limit would
+            # reject short clips of long sources. Cuts land on the keyframe at or
+            # before the margin, and _process trims precisely afterwards.
+            ranged_opts = dict(ydl_opts, max_filesize=None,
+                               download_ranges=load_yt_dlp().utils.download_range_func(None, [section]))
+            try:
+                path, width, height, sectioned = self._fetch(url, ranged_opts, info)
+                if sectioned:
+                    logging.info(f"Fetched source range {section[0]:.0f}-{section[1]:.0f}s only.")
+                    return path, width, height, section[0]
+                return path, width, height, 0
+            except yt_dlp.utils.DownloadError as e:
+                logging.warning(f"Ranged download failed, fetching the full source: {e}")
+
+        path, width, height, _ = self._fetch(url, ydl_opts, info)
+        return path, width, height, 0
+
+    def _download_progress(self, status: dict):
+        """yt-dlp progress hook; raising here aborts the download."""
+        self.control.check()
+        if status['status'] == 'downloading':
+            total = status.get('total_bytes') or status.get('total_bytes_estimate')
+            done = status.get('downloaded_bytes')
+            self.control.report('download', min(done / total, 1.0) if total and done is not None else None)
+
+    def _fetch(self, url: str, ydl_opts: dict, info: Optional[dict] = None) -> Tuple[str, int, int, bool]:
+        ydl_opts = dict(ydl_opts, progress_hooks=[self._download_progress])
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
+            with SESSIONS.session('download', **ydl_opts) as ydl:
+                if info:
+                    # Same path as --load-info-json: formats are re-selected, the page is not re-fetched
+                    info = copy.deepcopy(info)
+                    info.pop('requested_downloads', None)
+                    info = ydl.process_ie_result(info, download=True)
+                else:
+                    info = ydl.extract_info(url, download=True)
+                sectioned = False
                 if 'requested_downloads' in info and info['requested_downloads']:
-                    final_path = info['requested_downloads'][0]['filepath']
+                    download = info['requested_downloads'][0]
+                    final_path = download['filepath']
+                    sectioned = download.get('section_start') is not None
                 else:
                     final_path = ydl.prepare_filename(info)
-                return final_path, info.get('width', 0), info.get('height', 0)
+                return final_path, info.get('width', 0), info.get('height', 0), sectioned
 
         except yt_dlp.utils.DownloadError as e:
             if "File is larger than max-filesize" in str(e):
                 raise VideoSourceTooLarge()
             raise e
 
-    def _process(self, input_path: str, output_path: str, job: VideoJob) -> str:
+    def _encode_progress(self, duration: float) -> Callable[[dict], None]:
+        """ffmpeg -progress callback: checks for cancellation and reports the encoded fraction."""
+        def on_progress(values: dict):
+            self.control.check()
+            try:
+                done = int(values.get('out_time_us', '')) / 1e6
+            except ValueError:
+                done = None
+            fraction = min(max(done / duration, 0.0), 1.0) if done is not None and duration > 0 else None
+            self.control.report('encode', fraction)
+            speed = values.get('speed', '').rstrip('x').strip()
+            if speed.replace('.', '', 1).isdigit() and float(speed) > 0:
+                self.trace.set('ffmpeg_speed', float(speed))
+        return on_progress
+
+    def _run_tracked(self, cmd: List[str]) -> bytes:
+        """Runs a probe or GIF sample under the job's control, so cancel() kills it too."""
+        try:
+            return run_tracked(cmd, on_start=self.control.track)
+        except subprocess.CalledProcessError:
+            self.control.check()
+            raise
+
+    def _run_ffmpeg(self, cmd: List[str], source: Optional[Tuple[bytes, BinaryIO]] = None, duration: float = 0):
+        """Runs ffmpeg under the job's control; `duration` is the expected output length, if known."""
+        with self.trace.span('encode'):
+            try:
+                fed, _ = run_ffmpeg(cmd, *(source or (None, None)), on_progress=self._encode_progress(duration),
+                                    on_start=self.control.track)
+            except subprocess.CalledProcessError:
+                # A process killed by cancel() looks like an ffmpeg failure
+                self.control.check()
+                raise
+        if source:
+            self.trace.add('bytes_in', fed)
+        self.trace.add('encodes', 1)
+
+    def _process(self, input_path: str, output_path: str, job: VideoJob, plan: Optional[EncodePlan] = None,
+                 meta: Optional[dict] = None, source: Optional[Tuple[bytes, BinaryIO]] = None) -> str:
+        """
+        Trims, scales and encodes `input_path` into `output_path`. When streaming,
+        `input_path` is "pipe:0", `source` is (peeked head, response) and `meta`
+        replaces the ffprobe call that a pipe cannot answer.
+        """
+        if meta is None and not source:
+            meta = self._probe_file(input_path)
+
         # 1. Start with user requested filters
         filters = []
         start_args = ['-ss', job.start_time] if job.start_time else []
@@ -116,14 +522,21 @@ class VideoDownloader:
 
         # 2. SAFETY CHECK: Proactively downscale for GIFs
         if job.format == "gif":
-            meta = self._probe_file(input_path)
+            meta = meta or self._probe_file(input_path)
             
             # A. Enforce Duration Limit (Max 30s)
-            # If user didn't specify end time, and video is long, cut it.
-            if not duration_args and meta['duration'] > MAX_GIF_LENGTH:
-                logging.warning(f"Video duration {meta['duration']}s > {MAX_GIF_LENGTH}s. Clipping GIF.")
-                duration_args = ['-t', str(MAX_GIF_LENGTH)]
+            # Applies to user ranges too; the fetched section only covers MAX_GIF_LENGTH of them.
+            limit = self._clip_duration(job, meta['duration'])
+            start = hhmmss_to_seconds(job.start_time) or 0
+            requested = (hhmmss_to_seconds(job.end_time) or meta['duration']) - start
+            if limit and requested > limit:
+                logging.warning(f"GIF duration {requested}s > {limit}s. Clipping GIF.")
+                duration_args = ['-t', str(limit)]
             
+            if plan and plan.mode == "gif":
+                # Sampled plan; already within the width and fps caps below
+                job.width, job.height, job.framerate = plan.width, -1, plan.fps
+
             # B. Enforce Resolution Limit (Max 320px width)
             # Use requested width OR source width
             target_w = job.width or meta['width']
@@ -139,6 +552,11 @@ class VideoDownloader:
                 logging.info(f"Lowering GIF fps from {target_fps} to {SAFE_GIF_FPS}.")
                 job.framerate = SAFE_GIF_FPS
 
+            # D. Enforce the frame budget
+            if limit and job.framerate * limit > MAX_GIF_FRAMES:
+                job.framerate = max(1, int(MAX_GIF_FRAMES / limit))
+                logging.info(f"Lowering GIF fps to {job.framerate} to stay within {MAX_GIF_FRAMES} frames.")
+
         # 3. Build Filter Chain (with updated safety values)
         if job.framerate:
             filters.append(f"fps={job.framerate}")
@@ -156,44 +574,51 @@ class VideoDownloader:
             if job.format == 'mp4': filters.append("setsar=1")
 
         vf = ",".join(filters) if filters else None
+        # Stay within the CPU share the scheduler admitted the job with
+        threads = str(job.threads) if job.threads else 'auto'
+        expected = self._clip_duration(job, meta['duration'] if meta else 0)
 
         try:
             if job.format == "gif":
-                palette_path = os.path.join(self.download_dir, f"palette_{get_timestamp()}.png")
-                try:
-                    # Pass 1: Palette
-                    subprocess.run([
-                        'ffmpeg', *start_args, *duration_args,
-                        '-i', input_path,
-                        '-vf', f"{vf},palettegen" if vf else 'palettegen',
-                        '-y', palette_path,
-                        '-threads', 'auto'
-                    ], check=True, capture_output=True)
-
-                    # Pass 2: GIF Generation
-                    subprocess.run([
-                        'ffmpeg', *start_args, *duration_args,
-                        '-i', input_path,
-                        '-i', palette_path,
-                        '-lavfi', f"{vf} [x]; [x][1:v] paletteuse" if vf else 'paletteuse',
-                        '-y', output_path,
-                        '-threads', 'auto'
-                    ], check=True, capture_output=True)
-                finally:
-                    if os.path.exists(palette_path):
-                        os.remove(palette_path)
+                self._run_ffmpeg(
+                    gif_command(input_path, output_path, vf, [*start_args, *duration_args], threads,
+                                plan.palette if plan else gif_palettes(job.gif_dither)[0]), source, expected
+                )
+            elif plan and plan.mode != "encode":
+                # Stream copy: seek on the input so the cut starts on the keyframe
+                self._run_ffmpeg([
+                    'ffmpeg', *start_args, *duration_args, '-i', input_path,
+                    '-map', '0:v:0', '-map', '0:a:0?', '-c', 'copy',
+                    '-avoid_negative_ts', 'make_zero', '-movflags', '+faststart',
+                    '-y', output_path
+                ], source, expected)
             else:
                 # MP4/MP3
                 cmd = ['ffmpeg', '-i', input_path, *start_args, *duration_args]
                 if vf: cmd += ['-vf', vf]
-                cmd += [
-                    '-c:v', 'libx264' if job.format == 'mp4' else 'copy',
-                    '-preset', 'fast', '-crf', '23',
-                    '-c:a', 'aac' if job.format != 'mp3' else 'copy',
-                    '-b:a', '128k',
-                    '-y', output_path, '-threads', 'auto'
-                ]
-                subprocess.run(cmd, check=True, capture_output=True)
+                if job.format == 'mp4':
+                    video_args = ['-c:v', 'libx264', '-preset', job.preset or X264_PRESET, '-crf', '23']
+                    # Capped CRF: quality-driven, but never above the size budget
+                    if plan and plan.video_kbps:
+                        video_args += ['-maxrate', f"{plan.video_kbps}k", '-bufsize', f"{plan.video_kbps}k"]
+                    audio_args = ['-c:a', 'aac', '-b:a', f"{plan.audio_kbps if plan else AUDIO_BITRATE_KBPS}k"]
+                    if not source and self._encode_segmented(input_path, output_path, job, vf, video_args, audio_args):
+                        return output_path
+                    cmd += video_args + audio_args
+                else:
+                    meta = meta or self._probe_file(input_path)
+                    audio_kbps = plan.audio_kbps if plan else AUDIO_BITRATE_KBPS
+                    cmd += ['-vn']
+                    # Copy only when the source bitrate is known to fit; a copy cannot be corrected
+                    copied_kbits = meta['bitrate'] / 1000 * expected
+                    if (meta['audio_codec'] == 'mp3' and audio_kbps >= AUDIO_BITRATE_KBPS
+                            and 0 < copied_kbits <= size_budget_kbits()):
+                        cmd += ['-c:a', 'copy']
+                    else:
+                        # Native m4a/opus sources, high bitrate mp3s, or long audio that needs a lower bitrate
+                        cmd += ['-c:a', 'libmp3lame', '-b:a', f"{audio_kbps}k"]
+                cmd += ['-threads', threads, '-y', output_path]
+                self._run_ffmpeg(cmd, source, expected)
 
         except subprocess.CalledProcessError as e:
             logging.error(f"FFmpeg error: {e.stderr.decode() if e.stderr else str(e)}")
@@ -201,6 +626,46 @@ class VideoDownloader:
         
         return output_path
 
+    def _encode_segmented(self, input_path: str, output_path: str, job: VideoJob, vf: Optional[str],
+                          video_args: List[str], audio_args: List[str]) -> bool:
+        """
+        Encodes a long mp4 clip as keyframe-aligned segments in parallel ffmpeg
+        processes. Returns False without doing anything when the clip is short,
+        the job has a single CPU or the source lacks usable keyframes.
+        """
+        count = min(MAX_SEGMENTS, job.threads or os.cpu_count() or 1)
+        start = hhmmss_to_seconds(job.start_time) or 0
+        end = hhmmss_to_seconds(job.end_time)
+        if count < 2 or (end is not None and end - start < SEGMENT_MIN_CLIP):
+            return False
+        meta = self._probe_file(input_path, keyframes=True)
+        duration = self._clip_duration(job, meta['duration'])
+        if duration < SEGMENT_MIN_CLIP:
+            return False
+        segments = split_segments(meta['keyframes'], start, duration, count, SEGMENT_MIN_LENGTH)
+        if len(segments) < 2:
+            return False
+
+        logging.info(f"Encoding {duration:.0f}s as {len(segments)} parallel segments.")
+        scratch_prefix = os.path.join(job.work_dir or self.download_dir, job.output_name)
+        started = time.perf_counter()
+        on_progress = self._encode_progress(duration)
+        with self.trace.span('encode'):
+            try:
+                encode_segments(
+                    input_path, output_path, segments, video_args, audio_args if meta['audio_codec'] else None,
+                    vf, max(1, (job.threads or count) // len(segments)), scratch_prefix,
+                    on_start=self.control.track,
+                    on_progress=lambda done: on_progress({'out_time_us': str(int(done * 1e6))})
+                )
+            except subprocess.CalledProcessError:
+                self.control.check()
+                raise
+        self.trace.add('encodes', 1)
+        self.trace.set('segments', len(segments))
+        self.trace.set('ffmpeg_speed', round(duration / (time.perf_counter() - started), 2))
+        return True
+
     def _get_duration(self, start: str, end: str) -> str:
         from datetime import datetime
         fmt = "%H:%M:%S"
@@ -208,37 +673,252 @@ class VideoDownloader:
         end_dt = datetime.strptime(end, fmt)
         duration = (end_dt - start_dt).seconds
         return str(duration)
+
+    def _clip_duration(self, job: VideoJob, source_duration: float) -> float:
+        """Length in seconds of the output after the requested trim is applied."""
+        start = hhmmss_to_seconds(job.start_time) or 0
+        end = hhmmss_to_seconds(job.end_time)
+        if source_duration > 0:
+            end = min(end, source_duration) if end is not None else source_duration
+        if end is None:
+            return 0
+        if job.format == "gif":
+            return min(end - start, MAX_GIF_LENGTH)
+        return max(end - start, 0)
+
+    def estimate_cost(self, job: VideoJob, meta: dict) -> JobCost:
+        """Scheduler cost for `job`, given the metadata returned by probe_source."""
+        clip_duration = self._clip_duration(job, meta['duration'])
+        return estimate_cost(job.format, meta, clip_duration, self._section(job) is not None,
+                             local_source=job.source_dir is None)
+
+    def _plan(self, input_path: str, job: VideoJob, allow_copy: bool = True) -> Optional[EncodePlan]:
+        start = hhmmss_to_seconds(job.start_time) or 0
+        wants_copy = allow_copy and job.format == "mp4" and not (job.width or job.height or job.framerate)
+        meta = self._probe_file(input_path, keyframes=wants_copy and start > 0)
+        if job.format == "gif":
+            return self._plan_gif(input_path, job, meta)
+        if wants_copy:
+            plan = plan_copy(meta, start, self._clip_duration(job, meta['duration']))
+            if plan:
+                return plan
+        return self._plan_from_meta(job, meta)
+
+    def _sample_gif(self, input_path: str, job: VideoJob, meta: dict, duration: float,
+                    width: int, fps: int, palette: GifPalette) -> float:
+        """Encodes GIF_SAMPLE_COUNT short windows of the clip and returns bytes per frame-pixel."""
+        start = hhmmss_to_seconds(job.start_time) or 0
+        window = min(GIF_SAMPLE_SECONDS, duration)
+        count = GIF_SAMPLE_COUNT if duration >= GIF_SAMPLE_COUNT * window else 1
+        height = gif_height(width, meta['width'], meta['height'])
+        sample_path = os.path.join(job.work_dir or self.download_dir, f"{job.output_name}_sample.gif")
+        total_bytes = 0
+        try:
+            for i in range(count):
+                self.control.check()
+                # Window centres spread evenly across the clip
+                offset = start + (duration - window) * (i + 1) / (count + 1)
+                self._run_tracked(gif_command(
+                    input_path, sample_path, f"fps={fps},scale={width}:{height}",
+                    ['-ss', f"{offset:.3f}", '-t', f"{window:.3f}"], '1', palette
+                ))
+                total_bytes += os.path.getsize(sample_path)
+        finally:
+            remove_file(sample_path)
+        return total_bytes / (count * window * fps * width * height)
+
+    def _plan_gif(self, input_path: str, job: VideoJob, meta: dict) -> Optional[EncodePlan]:
+        """Measures sampled windows of the clip and solves for the best GIF setting that fits."""
+        duration = self._clip_duration(job, meta['duration'])
+        if duration <= 0 or not meta['width']:
+            return None
+        max_width = min(SAFE_GIF_WIDTH, job.width or meta['width'], meta['width'])
+        max_fps = min(SAFE_GIF_FPS, job.framerate or SAFE_GIF_FPS)
+        ref_width = min(max_width, GIF_WIDTHS[0])
+        palettes = gif_palettes(job.gif_dither)
+        try:
+            with self.trace.span('gif_sample'):
+                samples = [
+                    self._sample_gif(input_path, job, meta, duration, ref_width, max_fps, palette)
+                    for palette in palettes
+                ]
+        except subprocess.CalledProcessError as e:
+            logging.warning(f"GIF sampling failed, using the fixed caps: {e}")
+            return None
+        return plan_gif(samples, meta['width'], meta['height'], duration, max_width, max_fps, palettes=palettes)
+
+    def _plan_from_meta(self, job: VideoJob, meta: dict) -> Optional[EncodePlan]:
+        duration = self._clip_duration(job, meta['duration'])
+        plan = plan_encode(job.format, duration, meta['width'], meta['height'], job.width, job.height)
+        if plan and plan.width and plan.height:
+            job.width, job.height = plan.width, plan.height
+        return plan
     
-    def run_job(self, job: VideoJob) -> str:
-        downloaded_path, native_w, native_h = self._download(job.url, job.format, job.output_name)
-        
+    def _stream_format(self, job: VideoJob, choice: Optional[FormatChoice]) -> Optional[dict]:
+        """The single HTTP format a job can be streamed from, or None for the file-based path."""
+        if not job.source_info or not choice or job.format not in ("mp4", "gif"):
+            return None
+        if hhmmss_to_seconds(job.start_time):
+            # Seeking needs a seekable input
+            return None
+        format_id = choice.spec.split('/')[0]
+        if '+' in format_id:
+            # Separate video and audio would need two inputs
+            return None
+        fmt = next((f for f in job.source_info.get('formats') or [] if f.get('format_id') == format_id), None)
+        if not fmt or fmt.get('protocol') not in ('http', 'https'):
+            return None
+        return fmt
+
+    def _try_stream(self, job: VideoJob, fmt: dict) -> Optional[str]:
+        """
+        Pipes a progressive source into ffmpeg as it downloads, so encoding overlaps
+        the transfer and the source never lands on disk. Returns None (after cleaning
+        up) when the source is not pipe-friendly or the output misses the size limit,
+        in which case the caller uses the file-based path.
+        """
+        job = dataclasses.replace(job)
+        output_path = self._get_output_path(job.output_name, job.format, job.work_dir)
+        info = job.source_info
+        meta = {
+            'duration': float(info.get('duration') or 0),
+            'width': int(fmt.get('width') or info.get('width') or 0),
+            'height': int(fmt.get('height') or info.get('height') or 0),
+        }
+        plan = self._plan_from_meta(job, meta)
+        try:
+            with SESSIONS.session('download') as ydl:
+                response = ydl.urlopen(yt_dlp.networking.Request(fmt['url'], headers=fmt.get('http_headers') or {}))
+                try:
+                    head = response.read(STREAM_PEEK_BYTES)
+                    if not is_streamable(head, fmt.get('ext')):
+                        logging.info("Source index is not at the front; using the file-based path.")
+                        return None
+                    self._process('pipe:0', output_path, job, plan, meta, (head, response))
+                finally:
+                    response.close()
+        except (subprocess.CalledProcessError, yt_dlp.utils.YoutubeDLError, OSError) as e:
+            logging.warning(f"Streaming failed, using the file-based path: {e}")
+            remove_file(output_path)
+            return None
+
+        if os.path.getsize(output_path) > MAX_SIZE_MB * 1024 * 1024:
+            logging.info("Streamed output is over the size limit; using the file-based path.")
+            remove_file(output_path)
+            return None
+        self.trace.set('mode', plan.mode if plan else 'encode')
+        logging.info(f"Job {job.output_name} finished after 1 encode(s), streamed.")
+        return output_path
+
+    def run_job(self, job: VideoJob, lookup: bool = True) -> str:
+        """
+        Returns the output for `job` from the cache, or runs the pipeline and caches it.
+        Callers that already looked the job up pass lookup=False.
+        """
+        cache_key = None
+        if self.cache:
+            # Key on the options as requested, before planning rewrites them
+            cache_key = self.job_key(job)
+            cached_path = self.cache.get(cache_key) if lookup else None
+            if lookup:
+                self.trace.set('cache', 'hit' if cached_path else 'miss')
+            if cached_path:
+                return cached_path
+
+        output_path = self.pipeline(job, self.trace, self.control)
+        if cache_key:
+            output_path = self.cache.put(cache_key, output_path)
+        return output_path
+
+    def _run_pipeline(self, job: VideoJob) -> str:
+        return self.encode(job, self.fetch(job))
+
+    def fetch(self, job: VideoJob) -> Optional[FetchedSource]:
+        """
+        Network stage: downloads the job's source and shifts its trim to the fetched
+        range. Returns None for jobs that stream straight into the encode stage.
+        """
+        choice = self.select_source(job, job.source_info) if job.source_info else None
+        if self._stream_format(job, choice):
+            return None
+        return self._fetch_source(job, choice)
+
+    def _fetch_source(self, job: VideoJob, choice: Optional[FormatChoice]) -> FetchedSource:
+        with self.trace.span('download'):
+            downloaded_path, native_w, native_h, offset = self._download(
+                job.url, job.format, job.output_name, self._section(job), job.source_info,
+                choice.spec if choice else None, job.source_dir or job.work_dir
+            )
+        self.trace.add('bytes_in', os.path.getsize(downloaded_path))
+        if offset:
+            # Re-express the trim relative to the start of the fetched range
+            job.start_time = seconds_to_hhmmss((hhmmss_to_seconds(job.start_time) or 0) - offset)
+            job.end_time = seconds_to_hhmmss(hhmmss_to_seconds(job.end_time) - offset)
+        return FetchedSource(downloaded_path, native_w, native_h)
+
+    def encode(self, job: VideoJob, source: Optional[FetchedSource]) -> str:
+        """
+        CPU stage: turns a fetched source into the final output. Without a fetched
+        source the job is streamed, falling back to a download if that fails.
+        The source file is removed afterwards.
+        """
+        if source is None:
+            choice = self.select_source(job, job.source_info) if job.source_info else None
+            stream_format = self._stream_format(job, choice)
+            output_path = self._try_stream(job, stream_format) if stream_format else None
+            if output_path:
+                return output_path
+            source = self._fetch_source(job, choice)
+        downloaded_path, native_w, native_h = source.path, source.width, source.height
+
         try:
             base_name, _ = os.path.splitext(os.path.basename(downloaded_path))
-            output_path = self._get_output_path(base_name, job.format)
-            
-            self._process(downloaded_path, output_path, job)
-            
-            # Post-process check for file size (Auto-resize loop)
-            # Only needed for MP4s usually, but good generic safety
-            for attempt in range(5):
+            output_path = self._get_output_path(base_name, job.format, job.work_dir)
+
+            plan = self._plan(downloaded_path, job)
+            self._process(downloaded_path, output_path, job, plan)
+            encodes = 1
+
+            if plan and plan.mode in ("remux", "cut") and os.path.getsize(output_path) > MAX_SIZE_MB * 1024 * 1024:
+                logging.info("Stream copy overshot the size limit; re-encoding.")
+                plan = self._plan(downloaded_path, job, allow_copy=False)
+                self._process(downloaded_path, output_path, job, plan)
+                encodes += 1
+
+            # Budgeted encodes and sampled GIF plans land under the limit on the first pass;
+            # the loop only corrects unplanned outputs (unknown duration) or rare overshoots.
+            max_attempts = MAX_ENCODE_ATTEMPTS if plan and (plan.video_kbps or plan.mode == "gif") else 5
+            for attempt in range(max_attempts - 1):
                 if not os.path.exists(output_path): break
                 size_mb = os.path.getsize(output_path) / (1024 * 1024)
                 
                 if size_mb <= MAX_SIZE_MB:
-                    return output_path
+                    break
 
                 logging.info(f"File size {size_mb:.2f}MB > {MAX_SIZE_MB}MB. Scaling down.")
-                ratio = math.sqrt((size_mb / MAX_SIZE_MB) * 1.1)
-                
-                # Use current job settings or native if unset
-                current_w = job.width or native_w
-                current_h = job.height or native_h
+                ratio = (size_mb / MAX_SIZE_MB) * 1.1
+
+                if plan and plan.video_kbps:
+                    plan.video_kbps = int(plan.video_kbps / ratio)
+                elif plan and plan.mode == "gif":
+                    plan.width = int(plan.width / math.sqrt(ratio))
+                elif job.format == "mp3":
+                    # Resolution means nothing to audio; lower the bitrate instead
+                    plan = plan or EncodePlan()
+                    plan.audio_kbps = int(plan.audio_kbps / ratio)
+                else:
+                    # Use current job settings or native if unset
+                    current_w = job.width or native_w
+                    current_h = job.height or native_h
 
-                job.width = int(current_w / ratio)
-                job.height = int(current_h / ratio)
+                    job.width = int(current_w / math.sqrt(ratio))
+                    job.height = int(current_h / math.sqrt(ratio))
                 
-                self._process(downloaded_path, output_path, job)
+                self._process(downloaded_path, output_path, job, plan)
+                encodes += 1
 
+            self.trace.set('mode', plan.mode if plan else 'encode')
+            logging.info(f"Job {job.output_name} finished after {encodes} encode(s), last mode {plan.mode if plan else 'encode'}.")
             final_size = os.path.getsize(output_path) / (1024 * 1024)
             if final_size > MAX_SIZE_MB:
                 if os.path.exists(output_path): os.remove(output_path)
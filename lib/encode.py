@@ -0,0 +1,130 @@
+import logging
+from dataclasses import dataclass
+from typing import Optional, Tuple, List
+from lib.utils import (
+    MAX_SIZE_MB, AUDIO_BITRATE_KBPS, MIN_VIDEO_KBPS, MIN_AUDIO_KBPS, CONTAINER_OVERHEAD, KEYFRAME_TOLERANCE,
+    VideoOutputTooLarge
+)
+
+# (max output height, minimum video kbps that still looks acceptable at that height)
+RESOLUTION_LADDER = (
+    (1080, 3000),
+    (720, 1500),
+    (480, 750),
+    (360, 400),
+    (240, 200),
+    (144, 0),
+)
+
+@dataclass
+class EncodePlan:
+    """Encoder settings chosen for one output before ffmpeg runs."""
+    width: Optional[int] = None
+    height: Optional[int] = None
+    video_kbps: Optional[int] = None
+    audio_kbps: int = AUDIO_BITRATE_KBPS
+    mode: str = "encode"  # encode, remux (-c copy), cut (-c copy with a trim) or gif
+    fps: Optional[int] = None
+    palette: Optional["GifPalette"] = None  # gif mode only, see lib.gif
+
+def size_budget_kbits(max_size_mb: float = MAX_SIZE_MB) -> float:
+    """Usable payload in kilobits once container overhead is set aside."""
+    return max_size_mb * 8 * 1024 * (1 - CONTAINER_OVERHEAD)
+
+def target_video_kbps(duration: float, audio_kbps: int = AUDIO_BITRATE_KBPS,
+                      max_size_mb: float = MAX_SIZE_MB) -> int:
+    """
+    Video bitrate that keeps a clip of `duration` seconds under the size limit.
+    One extra second is budgeted for the VBV buffer, which can overshoot
+    the average by up to one buffer size.
+    """
+    total_kbps = size_budget_kbits(max_size_mb) / (duration + 1)
+    return int(total_kbps - audio_kbps)
+
+def _even(value: int) -> int:
+    return max(2, value - value % 2)
+
+def pick_resolution(video_kbps: int, src_w: int, src_h: int,
+                    req_w: Optional[int] = None, req_h: Optional[int] = None) -> Optional[Tuple[int, int]]:
+    """
+    Picks the tallest ladder rung the bitrate can sustain, never upscaling past
+    the requested (or source) size, and keeps the source aspect ratio.
+    Returns None when no downscale is needed.
+    """
+    base_w = req_w if req_w and req_w > 0 else src_w
+    base_h = req_h if req_h and req_h > 0 else src_h
+    if not base_w or not base_h:
+        return None
+
+    for rung_h, min_kbps in RESOLUTION_LADDER:
+        if video_kbps >= min_kbps:
+            if rung_h < base_h:
+                scale = rung_h / base_h
+                return _even(int(base_w * scale)), _even(rung_h)
+            break
+    return None
+
+def plan_encode(format: str, duration: float, src_w: int, src_h: int,
+                req_w: Optional[int] = None, req_h: Optional[int] = None,
+                max_size_mb: float = MAX_SIZE_MB) -> Optional[EncodePlan]:
+    """
+    Builds a size-budgeted plan for mp4/mp3 outputs.
+    Returns None when the duration is unknown and no budget can be computed.
+    """
+    if duration <= 0:
+        return None
+
+    if format == "mp3":
+        audio_kbps = int(size_budget_kbits(max_size_mb) / duration)
+        if audio_kbps < MIN_AUDIO_KBPS:
+            raise VideoOutputTooLarge(
+                f"A {duration:.0f}s clip leaves only {audio_kbps}kbps for audio under {max_size_mb}MB."
+            )
+        return EncodePlan(audio_kbps=min(AUDIO_BITRATE_KBPS, audio_kbps))
+
+    if format != "mp4":
+        return None
+
+    video_kbps = target_video_kbps(duration, AUDIO_BITRATE_KBPS, max_size_mb)
+    if video_kbps < MIN_VIDEO_KBPS:
+        raise VideoOutputTooLarge(
+            f"A {duration:.0f}s clip leaves only {video_kbps}kbps for video under {max_size_mb}MB."
+        )
+
+    plan = EncodePlan(video_kbps=video_kbps)
+    rung = pick_resolution(video_kbps, src_w, src_h, req_w, req_h)
+    if rung:
+        plan.width, plan.height = rung
+    logging.info(f"Encode plan: {duration:.1f}s at {video_kbps}kbps, scale to {rung or 'source'}.")
+    return plan
+
+# Codecs every Discord client plays inline without a re-encode
+COPYABLE_VIDEO = ("h264",)
+COPYABLE_AUDIO = ("aac", None)
+COPYABLE_PIX_FMTS = ("yuv420p", "yuvj420p")
+
+def keyframe_near(keyframes: List[float], start: float, tolerance: float = KEYFRAME_TOLERANCE) -> bool:
+    """True when a keyframe sits at or up to `tolerance` seconds before `start`."""
+    return any(start - tolerance <= k <= start + 0.001 for k in keyframes)
+
+def plan_copy(meta: dict, start: float, duration: float,
+              max_size_mb: float = MAX_SIZE_MB) -> Optional[EncodePlan]:
+    """
+    Returns a stream-copy plan when the probed source (see _probe_file) already
+    satisfies an mp4 request, or None when it has to be re-encoded.
+    """
+    if meta['video_codec'] not in COPYABLE_VIDEO or meta['audio_codec'] not in COPYABLE_AUDIO:
+        return None
+    if meta['pix_fmt'] not in COPYABLE_PIX_FMTS or duration <= 0:
+        return None
+
+    expected_kbits = meta['bitrate'] / 1000 * duration
+    if not meta['bitrate'] or expected_kbits > size_budget_kbits(max_size_mb):
+        return None
+
+    if start > 0 and not keyframe_near(meta['keyframes'], start):
+        return None
+
+    mode = "cut" if start > 0 or duration < meta['duration'] else "remux"
+    logging.info(f"Encode plan: stream copy ({mode}), about {expected_kbits / 8 / 1024:.1f}MB.")
+    return EncodePlan(mode=mode)
@@ -0,0 +1,105 @@
+import logging
+from dataclasses import dataclass
+from typing import Optional, List
+from lib.utils import SOURCE_FORMAT, SAFE_GIF_WIDTH, AUDIO_BITRATE_KBPS
+from lib.encode import RESOLUTION_LADDER, target_video_kbps
+from lib.preflight import format_bytes, estimate_source_bytes
+
+@dataclass
+class FormatChoice:
+    """yt-dlp format spec for the smallest source that still meets the output."""
+    spec: str
+    bytes: int
+    avoided_bytes: int
+    height: int = 0
+
+def _has_video(f: dict) -> bool:
+    vcodec = f.get('vcodec')
+    return bool(vcodec) and vcodec != 'none' and not vcodec.startswith('av01')
+
+def _has_audio(f: dict) -> bool:
+    acodec = f.get('acodec')
+    return bool(acodec) and acodec != 'none'
+
+def _width(f: dict) -> int:
+    return f.get('width') or int((f.get('height') or 0) * 16 / 9)
+
+def _prefer(formats: List[dict], ext: str) -> List[dict]:
+    preferred = [f for f in formats if f.get('ext') == ext]
+    return preferred or formats
+
+def target_height(clip_duration: float, req_h: Optional[int]) -> int:
+    """Output height an mp4 can afford within the size budget, capped by the request."""
+    video_kbps = target_video_kbps(clip_duration)
+    rung = next((h for h, min_kbps in RESOLUTION_LADDER if video_kbps >= min_kbps), RESOLUTION_LADDER[-1][0])
+    return min(rung, req_h) if req_h and req_h > 0 else rung
+
+def _smallest_meeting(formats: List[dict], meets, duration: float) -> Optional[dict]:
+    if not formats:
+        return None
+    ok = [f for f in formats if meets(f)]
+    if ok:
+        # format_bytes already estimates from tbr; sizes still unknown sort last instead of as 0 bytes
+        def cost(f):
+            size = format_bytes(f, duration)
+            return not size, size, f.get('height') or 0
+        return min(ok, key=cost)
+    # Nothing is big enough: take the closest, i.e. the largest available
+    return max(formats, key=lambda f: (f.get('height') or 0, format_bytes(f, duration)))
+
+def _pick_audio(formats: List[dict], ext: Optional[str], duration: float) -> Optional[dict]:
+    audio = [f for f in formats if _has_audio(f) and f.get('vcodec') == 'none']
+    if ext:
+        audio = _prefer(audio, ext)
+    return _smallest_meeting(audio, lambda f: (f.get('abr') or f.get('tbr') or 0) >= AUDIO_BITRATE_KBPS, duration)
+
+def select_source(info: dict, format: str, clip_duration: float,
+                  req_w: Optional[int] = None, req_h: Optional[int] = None) -> Optional[FormatChoice]:
+    """
+    Picks the cheapest source formats from a preflight info dict for the requested output.
+    Returns None when the format list gives nothing to choose from.
+    """
+    formats = info.get('formats') or []
+    duration = info.get('duration') or 0
+    if not formats:
+        return None
+    default_bytes = estimate_source_bytes(info, format)
+
+    if format == "mp3":
+        audio = _pick_audio(formats, None, duration)
+        if not audio:
+            return None
+        chosen, spec, height = [audio], f"{audio['format_id']}/bestaudio", 0
+    else:
+        if format == "gif":
+            target_w = min(req_w, SAFE_GIF_WIDTH) if req_w and req_w > 0 else SAFE_GIF_WIDTH
+            meets = lambda f: _width(f) >= target_w
+        else:
+            if clip_duration <= 0:
+                return None
+            target_h = target_height(clip_duration, req_h)
+            meets = lambda f: (f.get('height') or 0) >= target_h
+
+        video_only = _prefer([f for f in formats if _has_video(f) and not _has_audio(f) and f.get('height')], 'mp4')
+        progressive = _prefer([f for f in formats if _has_video(f) and _has_audio(f) and f.get('height')], 'mp4')
+        video = _smallest_meeting(video_only, meets, duration)
+        # GIFs need no audio track at all
+        audio = _pick_audio(formats, 'm4a', duration) if format != "gif" and video else None
+        if video and (audio or format == "gif"):
+            chosen = [video, audio] if audio else [video]
+            spec = "+".join(f['format_id'] for f in chosen)
+        else:
+            video = _smallest_meeting(progressive, meets, duration)
+            if not video:
+                return None
+            chosen, spec = [video], video['format_id']
+        spec = f"{spec}/{SOURCE_FORMAT}"
+        height = video.get('height') or 0
+
+    chosen_bytes = sum(format_bytes(f, duration) for f in chosen)
+    avoided = max(default_bytes - chosen_bytes, 0) if default_bytes and chosen_bytes else 0
+    logging.info(
+        f"Selected source {spec} (~{chosen_bytes / (1024 * 1024):.1f}MB), "
+        f"avoiding ~{avoided / (1024 * 1024):.1f}MB."
+    )
+    return FormatChoice(spec=spec, bytes=chosen_bytes, avoided_bytes=avoided, height=height)
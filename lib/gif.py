@@ -0,0 +1,104 @@
+import logging
+from dataclasses import dataclass
+from typing import Optional, List, Sequence, Tuple
+from lib.utils import (
+    GIF_STATS_MODE, GIF_DITHER, GIF_BAYER_SCALE, MAX_GIF_FRAMES, MAX_SIZE_MB, GIF_SIZE_MARGIN
+)
+from lib.encode import EncodePlan
+
+@dataclass
+class GifPalette:
+    """palettegen/paletteuse settings. See ffmpeg-filters for the accepted values."""
+    stats_mode: str = GIF_STATS_MODE     # full, diff or single
+    dither: str = GIF_DITHER             # bayer, sierra2_4a, floyd_steinberg, none, ...
+    bayer_scale: int = GIF_BAYER_SCALE   # 0-5, only used by bayer; higher = less pattern, larger file
+    max_colors: int = 256
+
+    def palettegen(self) -> str:
+        return f"palettegen=max_colors={self.max_colors}:stats_mode={self.stats_mode}"
+
+    def paletteuse(self) -> str:
+        opts = f"paletteuse=dither={self.dither}"
+        if self.dither == "bayer":
+            opts += f":bayer_scale={self.bayer_scale}"
+        if self.stats_mode == "diff":
+            # Only re-dither the rectangle that changed, matching the diff palette
+            opts += ":diff_mode=rectangle"
+        if self.stats_mode == "single":
+            opts += ":new=1"
+        return opts
+
+def gif_filtergraph(vf: Optional[str], palette: GifPalette) -> str:
+    """Decodes once, then splits the stream between palettegen and paletteuse."""
+    head = f"[0:v]{vf}," if vf else "[0:v]"
+    return (
+        f"{head}split[a][b];"
+        f"[a]{palette.palettegen()}[p];"
+        f"[b][p]{palette.paletteuse()}"
+    )
+
+def gif_command(input_path: str, output_path: str, vf: Optional[str], seek_args: List[str],
+                threads: str = 'auto', palette: Optional[GifPalette] = None) -> List[str]:
+    """
+    Single ffmpeg invocation producing a GIF. `seek_args` (-ss/-t/-to) go before
+    the input so trimmed GIFs do not decode from time zero.
+    """
+    return [
+        'ffmpeg', *seek_args,
+        '-i', input_path,
+        '-filter_complex', gif_filtergraph(vf, palette or GifPalette()),
+        '-threads', threads, '-y', output_path
+    ]
+
+# Candidate settings, best looking first
+GIF_WIDTHS = (320, 280, 240, 200, 160, 120)
+GIF_FPS = (15, 12, 10, 8, 6)
+# Lower bayer scales show more pattern but compress better
+GIF_PALETTES = (GifPalette(), GifPalette(bayer_scale=2))
+
+def gif_palettes(dither: Optional[str] = None) -> Tuple[GifPalette, ...]:
+    """Candidate palettes for a preferred dither, best looking first."""
+    if dither is None or dither == GIF_DITHER:
+        return GIF_PALETTES
+    if dither == "none":
+        return (GifPalette(dither="none"),)
+    # Slower dithers fall back to the default ones if they cannot fit
+    return (GifPalette(dither=dither),) + GIF_PALETTES
+
+def gif_height(width: int, src_w: int, src_h: int) -> int:
+    return max(2, int(width * src_h / src_w)) if src_w and src_h else width
+
+def predict_gif_bytes(bytes_per_pixel: float, width: int, height: int, fps: float, duration: float) -> float:
+    """Output size from a sampled bytes-per-(frame x pixel) rate."""
+    return bytes_per_pixel * width * height * fps * duration
+
+def plan_gif(samples: Sequence[float], src_w: int, src_h: int, duration: float,
+             max_width: int, max_fps: int, max_size_mb: float = MAX_SIZE_MB,
+             palettes: Sequence[GifPalette] = GIF_PALETTES) -> EncodePlan:
+    """
+    Picks the setting with the most pixels per second, preferring the better
+    looking palette from `palettes` at equal settings, whose predicted size
+    fits `max_size_mb` (with GIF_SIZE_MARGIN).
+    `samples` holds the measured bytes per frame-pixel for each palette, in order.
+    The frame budget MAX_GIF_FRAMES caps fps for long clips. When nothing fits,
+    the smallest setting is returned and the caller's corrective pass takes over.
+    """
+    budget = max_size_mb * 1024 * 1024 * GIF_SIZE_MARGIN
+    fps_cap = min(max_fps, MAX_GIF_FRAMES / duration) if duration > 0 else max_fps
+    widths = [w for w in GIF_WIDTHS if w <= max_width] or [min(max_width, GIF_WIDTHS[-1])]
+    rates = [f for f in GIF_FPS if f <= fps_cap] or [max(1, int(fps_cap))]
+
+    candidates: List[Tuple[int, int, int]] = sorted(
+        ((w, f, p) for w in widths for f in rates for p in range(len(samples))),
+        key=lambda c: (-c[0] * c[0] * c[1], c[2])
+    )
+    for width, fps, p in candidates:
+        predicted = predict_gif_bytes(samples[p], width, gif_height(width, src_w, src_h), fps, duration)
+        if predicted <= budget:
+            logging.info(f"GIF plan: {width}px at {fps}fps, {palettes[p].dither} "
+                         f"scale {palettes[p].bayer_scale}, predicted {predicted / (1024 * 1024):.1f}MB.")
+            return EncodePlan(width=width, fps=fps, palette=palettes[p], mode="gif")
+
+    width, fps, p = candidates[-1]
+    logging.info(f"No GIF setting is predicted to fit; using {width}px at {fps}fps.")
+    return EncodePlan(width=width, fps=fps, palette=palettes[p], mode="gif")
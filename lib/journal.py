@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Optional, List, Set
+
+@dataclass
+class JournalEntry:
+    job_id: str
+    args: str                # The !download arguments, replayed on requeue
+    channel_id: int
+    guild_id: Optional[int]
+    author_id: int
+    stage: str               # queued, running or fetched
+    fields: dict             # VideoJob fields as of the last recorded stage
+    artifacts: dict          # 'source': FetchedSource fields of a finished download
+    attempts: int            # Times the job was requeued after a restart
+    created: float
+
+class JobJournal:
+    """
+    SQLite record of accepted jobs, so a restart can requeue them.
+
+    A job is recorded once it is accepted and updated as it passes each stage,
+    together with the files that stage left behind. Its row is deleted when the
+    job is delivered, fails or is cancelled; rows still present at startup belong
+    to jobs a restart interrupted. When SOURCE_FOLDER is set, sources are
+    downloaded there, so a finished download is reused and a partial one is
+    resumed by yt-dlp from the job's .part files, which keep their names because
+    a requeued job keeps its id. Otherwise a requeued job downloads again.
+    """
+    STAGES = ('queued', 'running', 'fetched')
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY,
+            args TEXT NOT NULL,
+            channel_id INTEGER NOT NULL,
+            guild_id INTEGER,
+            author_id INTEGER NOT NULL,
+            stage TEXT NOT NULL,
+            fields TEXT NOT NULL,
+            artifacts TEXT NOT NULL DEFAULT '{}',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created REAL NOT NULL,
+            updated REAL NOT NULL
+        )
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        # Autocommit; every write is a single statement
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(self.SCHEMA)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _fields(fields: dict) -> str:
+        # The preflight info is large and its format URLs expire; a requeued job resolves again
+        return json.dumps({k: v for k, v in fields.items() if k != 'source_info'})
+
+    def record(self, job_id: str, args: str, channel_id: int, guild_id: Optional[int], author_id: int,
+               fields: dict):
+        """Records an accepted job. A requeued job keeps its row, stage and artifacts."""
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (job_id, args, channel_id, guild_id, author_id, stage, fields, created, updated) "
+                "VALUES (?, ?, ?, ?, ?, 'queued', ?, ?, ?) ON CONFLICT(job_id) DO NOTHING",
+                (job_id, args, channel_id, guild_id, author_id, self._fields(fields), now, now)
+            )
+
+    def update(self, job_id: str, stage: str, fields: Optional[dict] = None, **artifacts):
+        """
+        Moves a job to `stage`, merging in the files it produced (e.g. source=...).
+        A requeued job passing an earlier stage again keeps the later stage and its fields.
+        """
+        with self._lock:
+            row = self._db.execute("SELECT artifacts, stage FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None or self.STAGES.index(stage) < self.STAGES.index(row[1]):
+                return
+            merged = dict(json.loads(row[0]), **artifacts)
+            self._db.execute(
+                "UPDATE jobs SET stage = ?, artifacts = ?, updated = ?, fields = COALESCE(?, fields) WHERE job_id = ?",
+                (stage, json.dumps(merged), time.time(), self._fields(fields) if fields else None, job_id)
+            )
+
+    def requeued(self, job_id: str):
+        with self._lock:
+            self._db.execute("UPDATE jobs SET attempts = attempts + 1, updated = ? WHERE job_id = ?",
+                             (time.time(), job_id))
+
+    def finish(self, job_id: str):
+        with self._lock:
+            self._db.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+
+    def _entry(self, row) -> JournalEntry:
+        job_id, args, channel_id, guild_id, author_id, stage, fields, artifacts, attempts, created = row
+        return JournalEntry(job_id, args, channel_id, guild_id, author_id, stage,
+                            json.loads(fields), json.loads(artifacts), attempts, created)
+
+    def get(self, job_id: str) -> Optional[JournalEntry]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT job_id, args, channel_id, guild_id, author_id, stage, fields, artifacts, attempts, created "
+                "FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        return self._entry(row) if row else None
+
+    def unfinished(self) -> List[JournalEntry]:
+        """Every job still in the journal, oldest first."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT job_id, args, channel_id, guild_id, author_id, stage, fields, artifacts, attempts, created "
+                "FROM jobs ORDER BY created"
+            ).fetchall()
+        return [self._entry(row) for row in rows]
+
+    def job_ids(self) -> Set[str]:
+        with self._lock:
+            return {row[0] for row in self._db.execute("SELECT job_id FROM jobs")}
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._db.execute("SELECT stage, COUNT(*) FROM jobs GROUP BY stage").fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+        logging.info(f"Closed job journal {self.path}.")
@@ -0,0 +1,196 @@
+import json
+import time
+import logging
+import threading
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Callable, Dict, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+BYTE_BUCKETS = tuple(mb * 1024 * 1024 for mb in (0.5, 1, 2, 5, 10, 25, 50, 100))
+
+def _label_str(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+class Histogram:
+    """Cumulative-bucket histogram that also keeps recent samples for quantiles."""
+    def __init__(self, name: str, help: str, buckets=DEFAULT_BUCKETS, samples: int = 500):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._series = defaultdict(lambda: {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0,
+                                            'recent': deque(maxlen=samples)})
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            series = self._series[key]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+            series['recent'].append(value)
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            recent = sorted(self._series[key]['recent']) if key in self._series else []
+        if not recent:
+            return None
+        return recent[min(int(q * len(recent)), len(recent) - 1)]
+
+    def label_values(self, label: str) -> list:
+        with self._lock:
+            return sorted({v for key in self._series for k, v in key if k == label})
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in self._series.items():
+                for bound, count in zip(self.buckets, series['counts']):
+                    lines.append(f"{self.name}_bucket{_label_str(key + (('le', str(bound)),))} {count}")
+                lines.append(f"{self.name}_bucket{_label_str(key + (('le', '+Inf'),))} {series['count']}")
+                lines.append(f"{self.name}_sum{_label_str(key)} {series['sum']}")
+                lines.append(f"{self.name}_count{_label_str(key)} {series['count']}")
+        return "\n".join(lines)
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            self._values[key] += amount
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            lines += [f"{self.name}{_label_str(key)} {value}" for key, value in self._values.items()]
+        return "\n".join(lines)
+
+class MetricsRegistry:
+    """Holds the bot's metrics and renders them in the Prometheus text format."""
+    def __init__(self):
+        self.histograms: Dict[str, Histogram] = {}
+        self.counters: Dict[str, Counter] = {}
+        self.gauges: Dict[str, Tuple[str, Callable[[], float]]] = {}
+
+    def histogram(self, name: str, help: str, buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.histograms.setdefault(name, Histogram(name, help, buckets))
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self.counters.setdefault(name, Counter(name, help))
+
+    def gauge(self, name: str, help: str, func: Callable[[], float]):
+        """Registers a gauge whose value is read from `func` at scrape time."""
+        self.gauges[name] = (help, func)
+
+    def render(self) -> str:
+        parts = [h.render() for h in self.histograms.values()] + [c.render() for c in self.counters.values()]
+        for name, (help, func) in self.gauges.items():
+            try:
+                value = func()
+            except Exception as e:
+                logging.warning(f"Gauge {name} failed: {e}")
+                continue
+            parts.append(f"# HELP {name} {help}\n# TYPE {name} gauge\n{name} {value}")
+        return "\n".join(parts) + "\n"
+
+    def serve(self, host: str, port: int) -> ThreadingHTTPServer:
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logging.info(f"Metrics available at http://{host}:{port}/metrics")
+        return server
+
+REGISTRY = MetricsRegistry()
+STAGE_SECONDS = REGISTRY.histogram("videobot_stage_seconds", "Wall time per job stage.")
+JOB_SECONDS = REGISTRY.histogram("videobot_job_seconds", "End-to-end job wall time.")
+JOB_BYTES = REGISTRY.histogram("videobot_job_bytes", "Bytes downloaded (in) and delivered (out) per job.", BYTE_BUCKETS)
+ENCODE_ATTEMPTS = REGISTRY.histogram("videobot_encode_attempts", "ffmpeg runs per job.", (0, 1, 2, 3, 4, 6))
+FFMPEG_SPEED = REGISTRY.histogram("videobot_ffmpeg_speed", "ffmpeg reported speed (x realtime).",
+                                  (0.25, 0.5, 1, 2, 4, 8, 16, 32))
+JOBS_TOTAL = REGISTRY.counter("videobot_jobs_total", "Finished jobs by format and outcome.")
+
+class JobTrace:
+    """
+    Span timings and counters for one job. Worker processes fill their own trace
+    and send it back with the result, where it is merged into the caller's.
+    """
+    def __init__(self, job_id: Optional[str] = None):
+        self.job_id = job_id
+        self.started = time.time()
+        self.spans = []      # (stage, seconds) in order
+        self.values = {}     # bytes_in, bytes_out, encodes, ffmpeg_speed, ...
+
+    @contextmanager
+    def span(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans.append((stage, time.perf_counter() - start))
+
+    def add(self, key: str, amount: float):
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, key: str, value):
+        self.values[key] = value
+
+    def to_dict(self) -> dict:
+        return {'spans': list(self.spans), 'values': dict(self.values)}
+
+    def merge(self, other: dict):
+        self.spans.extend(tuple(s) for s in other.get('spans', []))
+        for key, value in other.get('values', {}).items():
+            if isinstance(value, (int, float)) and key in self.values and key != 'ffmpeg_speed':
+                self.values[key] += value
+            else:
+                self.values[key] = value
+
+    def publish(self, outcome: str):
+        """Feeds the histograms and writes one JSON trace line to the log."""
+        total = time.time() - self.started
+        fmt = self.values.get('format', 'unknown')
+        for stage, seconds in self.spans:
+            STAGE_SECONDS.observe(seconds, stage=stage)
+        # Labelled by encoder preset to show the latency/size tradeoff of the quality controller
+        preset = self.values.get('preset', 'none')
+        JOB_SECONDS.observe(total, format=fmt, preset=preset)
+        for direction in ('in', 'out'):
+            if self.values.get(f'bytes_{direction}'):
+                JOB_BYTES.observe(self.values[f'bytes_{direction}'], direction=direction, preset=preset)
+        ENCODE_ATTEMPTS.observe(self.values.get('encodes', 0), format=fmt)
+        if self.values.get('ffmpeg_speed'):
+            FFMPEG_SPEED.observe(self.values['ffmpeg_speed'], format=fmt)
+        JOBS_TOTAL.inc(format=fmt, outcome=outcome)
+        logging.info("job_trace %s", json.dumps({
+            'job': self.job_id, 'outcome': outcome, 'total': round(total, 3),
+            'spans': [[stage, round(seconds, 3)] for stage, seconds in self.spans],
+            **self.values,
+        }))
@@ -0,0 +1,105 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from dataclasses import asdict
+from typing import Optional
+from lib.workers import WorkerPool
+from lib.metrics import JobTrace
+from lib.download import JobControl, FetchedSource
+from lib.journal import JobJournal
+
+class StagedPipeline:
+    """
+    Runs jobs through two separately sized worker pools: a network-bound fetch
+    stage and a CPU-bound encode stage.
+
+    A job that finished downloading takes a slot in a bounded hand-off queue and
+    waits there for an encoder. While the queue is full, fetch workers hold on to
+    their finished job and stop downloading, so downloads cannot run arbitrarily
+    far ahead of encoding and fill the scratch space.
+
+    With a `journal`, each fetched source is recorded there, and a job requeued
+    after a restart skips the fetch when its source is still on disk.
+    """
+    def __init__(self, fetch_pool: WorkerPool, encode_pool: WorkerPool, handoff_size: int,
+                 journal: Optional[JobJournal] = None):
+        self.fetch_pool = fetch_pool
+        self.encode_pool = encode_pool
+        self.handoff_size = handoff_size
+        self.journal = journal
+        self._handoff = threading.BoundedSemaphore(handoff_size)
+        self._waiting = 0
+        self._handoff_waits = deque(maxlen=100)
+        self._lock = threading.Lock()
+
+    def start(self):
+        self.fetch_pool.start()
+        self.encode_pool.start()
+
+    def _resume(self, job) -> Optional[tuple]:
+        """(fields, source) journaled by an interrupted run of `job` whose source still exists."""
+        entry = self.journal.get(job.output_name) if self.journal else None
+        if entry is None or not entry.artifacts.get('source'):
+            return None
+        if not os.path.isfile(entry.artifacts['source']['path']):
+            return None
+        return entry.fields, FetchedSource(**entry.artifacts['source'])
+
+    def run(self, job, trace: Optional[JobTrace] = None, control: Optional[JobControl] = None) -> str:
+        """Blocking: fetches then encodes `job` and returns the output path."""
+        resumed = self._resume(job)
+        if resumed:
+            logging.info(f"Job {job.output_name} was fetched before the restart, skipping to encode.")
+            fields, source = resumed
+            self._handoff.acquire()
+        else:
+            with self.fetch_pool.acquire() as worker:
+                if control is not None:
+                    control.check()
+                fields, source = self.fetch_pool.call(worker, 'fetch', job, trace, control=control)
+                # Block this fetch worker until the fetched source has somewhere to wait
+                self._handoff.acquire()
+            if self.journal and source is not None:
+                self.journal.update(job.output_name, 'fetched', fields=fields, source=asdict(source))
+        job.start_time, job.end_time = fields['start_time'], fields['end_time']
+
+        queued = time.monotonic()
+        with self._lock:
+            self._waiting += 1
+        try:
+            with self.encode_pool.acquire() as worker:
+                waited = time.monotonic() - queued
+                with self._lock:
+                    self._waiting -= 1
+                    self._handoff_waits.append(waited)
+                self._handoff.release()
+                queued = None
+                if trace is not None:
+                    trace.spans.append(('handoff', waited))
+                if control is not None:
+                    control.check()
+                return self.encode_pool.call(worker, 'encode', job, trace, source, control=control)
+        finally:
+            if queued is not None:
+                # Never reached an encoder
+                with self._lock:
+                    self._waiting -= 1
+                self._handoff.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            waits = list(self._handoff_waits)
+            waiting = self._waiting
+        return {
+            'fetch': self.fetch_pool.stats(),
+            'encode': self.encode_pool.stats(),
+            'handoff_waiting': waiting,
+            'handoff_size': self.handoff_size,
+            'avg_handoff_wait': sum(waits) / len(waits) if waits else 0.0,
+        }
+
+    def shutdown(self):
+        self.fetch_pool.shutdown()
+        self.encode_pool.shutdown()
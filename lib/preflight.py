@@ -0,0 +1,81 @@
+import time
+import threading
+from typing import Optional, Dict, Tuple
+
+def video_id(info: dict) -> Optional[str]:
+    """Canonical "<extractor>:<id>" for an extract_info result."""
+    extractor = info.get('extractor_key') or info.get('ie_key')
+    if extractor and info.get('id'):
+        return f"{extractor}:{info['id']}"
+    return None
+
+def format_bytes(fmt: dict, duration: float) -> int:
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if not size and fmt.get('tbr') and duration:
+        size = fmt['tbr'] * 1000 / 8 * duration
+    return int(size or 0)
+
+def estimate_source_bytes(info: dict, format: str) -> int:
+    """
+    Bytes a full download would fetch for an output `format`, from the formats
+    yt-dlp selected during preflight. 0 when the extractor gives no hint.
+    """
+    duration = info.get('duration') or 0
+    if format == "mp3":
+        audio = [f for f in info.get('formats') or [] if f.get('vcodec') == 'none' and f.get('acodec') != 'none']
+        if audio:
+            return format_bytes(max(audio, key=lambda f: f.get('abr') or f.get('tbr') or 0), duration)
+    formats = info.get('requested_formats') or [info]
+    return sum(format_bytes(f, duration) for f in formats)
+
+def summarize(info: dict, format: str) -> dict:
+    """The fields the scheduler and validation need, in the shape of _probe_file."""
+    return {
+        'id': video_id(info),
+        'duration': float(info.get('duration') or 0),
+        'width': int(info.get('width') or 0),
+        'height': int(info.get('height') or 0),
+        'filesize': estimate_source_bytes(info, format),
+    }
+
+class InfoCache:
+    """
+    TTL cache of sanitized extract_info(download=False) results.
+
+    Entries are stored by canonical video id, with every URL that resolved to
+    that id pointing at the same entry, so the preflight, the result cache key
+    and the download itself share one page resolution.
+    """
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._by_id: Dict[str, Tuple[float, dict]] = {}
+        self._url_to_id: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def _prune(self):
+        now = time.monotonic()
+        for key in [k for k, (stored, _) in self._by_id.items() if now - stored > self.ttl]:
+            del self._by_id[key]
+        for url in [u for u, key in self._url_to_id.items() if key not in self._by_id]:
+            del self._url_to_id[url]
+
+    def get(self, url: str) -> Optional[dict]:
+        with self._lock:
+            self._prune()
+            key = self._url_to_id.get(url, url)
+            entry = self._by_id.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1]
+
+    def put(self, url: str, info: dict):
+        key = video_id(info) or url
+        with self._lock:
+            self._by_id[key] = (time.monotonic(), info)
+            self._url_to_id[url] = key
+            if info.get('webpage_url'):
+                self._url_to_id[info['webpage_url']] = key
@@ -0,0 +1,72 @@
+import logging
+import statistics
+import threading
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from typing import Optional
+
+@dataclass(frozen=True)
+class QualityLevel:
+    preset: str        # libx264 -preset
+    speed: float       # rough encode speed relative to the "fast" preset
+    gif_dither: str    # paletteuse dither
+
+# Best compression first. Error diffusion looks best but is slower and larger,
+# so GIFs only get it when the planner still finds a setting that fits.
+QUALITY_LEVELS = (
+    QualityLevel("slow", 0.45, "sierra2_4a"),
+    QualityLevel("medium", 0.7, "sierra2_4a"),
+    QualityLevel("fast", 1.0, "bayer"),
+    QualityLevel("veryfast", 1.8, "bayer"),
+    QualityLevel("superfast", 2.6, "none"),
+    QualityLevel("ultrafast", 4.0, "none"),
+)
+DEFAULT_LEVEL = QUALITY_LEVELS[2]
+
+# ffmpeg speed (x realtime) at the "fast" level assumed until real jobs are seen
+DEFAULT_SPEED = {'mp4': 2.0, 'gif': 1.5}
+
+class QualityController:
+    """
+    Picks encoder settings per job from the current load.
+
+    Each job gets a share of the latency target that shrinks as the queue grows
+    (the jobs ahead of it spend the same target). Using the recent ffmpeg speed
+    for its format, normalized to the "fast" level, the controller picks the
+    best-compressing level whose predicted encode time fits that share.
+    """
+    def __init__(self, latency_target: float, encoders: int, samples: int = 50):
+        self.latency_target = latency_target
+        self.encoders = encoders
+        self._speeds = defaultdict(lambda: deque(maxlen=samples))
+        self._lock = threading.Lock()
+
+    def base_speed(self, format: str) -> float:
+        with self._lock:
+            recent = list(self._speeds[format])
+        return statistics.median(recent) if recent else DEFAULT_SPEED.get(format, 1.0)
+
+    def observe(self, format: str, preset: Optional[str], speed: Optional[float]):
+        """Records the ffmpeg speed a finished single-pass x264 job reached with `preset`."""
+        level = next((l for l in QUALITY_LEVELS if l.preset == preset), None)
+        if level is None or not speed:
+            return
+        with self._lock:
+            self._speeds[format].append(speed / level.speed)
+
+    def choose(self, format: str, clip_seconds: float, queue_depth: int) -> Optional[QualityLevel]:
+        """Settings for a job about to start, or None for formats without a choice (mp3)."""
+        if format not in DEFAULT_SPEED:
+            return None
+        speed = self.base_speed(format)
+        budget = self.latency_target / (1 + queue_depth / max(self.encoders, 1))
+        clip = clip_seconds or 60
+        for level in QUALITY_LEVELS:
+            if clip / (speed * level.speed) <= budget:
+                break
+        logging.info(f"Quality {level.preset}/{level.gif_dither} for a {clip:.0f}s {format} "
+                     f"(queue {queue_depth}, {speed:.2f}x at fast, budget {budget:.0f}s)")
+        return level
+
+    def stats(self) -> dict:
+        return {format: round(self.base_speed(format), 2) for format in DEFAULT_SPEED}
@@ -0,0 +1,172 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Optional, Callable, Awaitable, Hashable, List, Any
+from lib.utils import (
+    MAX_SIZE_MB, MAX_GIF_LENGTH, MAX_BACKFILL_WAIT, QUEUE_POSITION_INTERVAL
+)
+
+@dataclass
+class JobCost:
+    """Estimated resources a job holds while it runs."""
+    cpus: int
+    ram_mb: int
+    tmpfs_mb: int
+    seconds: float
+
+    def fits(self, free: "JobCost") -> bool:
+        return self.cpus <= free.cpus and self.ram_mb <= free.ram_mb and self.tmpfs_mb <= free.tmpfs_mb
+
+def _source_kbps(height: int) -> int:
+    """Typical delivered bitrate for a source of this height, used when yt-dlp has no filesize."""
+    if height >= 1080: return 5000
+    if height >= 720: return 2500
+    if height >= 480: return 1200
+    return 700
+
+def estimate_cost(format: str, meta: dict, clip_duration: float, ranged: bool, local_source: bool = True) -> JobCost:
+    """
+    Estimates CPU, RAM and tmpfs needs from a metadata probe
+    (duration, width, height and optional filesize, as returned by probe_source).
+    With local_source=False the source is downloaded outside the scratch space
+    and only the output and encode scratch count against tmpfs.
+    """
+    duration = meta.get('duration') or 0
+    height = meta.get('height') or 720
+    width = meta.get('width') or int(height * 16 / 9)
+    clip = clip_duration or duration or 60
+
+    if meta.get('filesize') and duration and not ranged:
+        source_mb = meta['filesize'] / (1024 * 1024)
+    else:
+        source_mb = (clip if ranged else (duration or clip)) * _source_kbps(height) / 8 / 1024
+    if not local_source:
+        source_mb = 0
+
+    if format == "mp3":
+        return JobCost(cpus=1, ram_mb=64, tmpfs_mb=int(source_mb * 0.2 + MAX_SIZE_MB), seconds=clip * 0.05)
+
+    megapixels = width * height / 1e6
+    if format == "gif":
+        clip = min(clip, MAX_GIF_LENGTH)
+        return JobCost(cpus=2, ram_mb=200, tmpfs_mb=int(source_mb + MAX_SIZE_MB * 2), seconds=clip * 0.5)
+
+    cpus = 1 if megapixels <= 0.4 else 2 if megapixels <= 1 else 4
+    ram_mb = 120 + int(megapixels * 150)
+    # Merging bestvideo+bestaudio briefly keeps both streams and the merged file
+    tmpfs_mb = int(source_mb * 2 + MAX_SIZE_MB)
+    return JobCost(cpus=cpus, ram_mb=ram_mb, tmpfs_mb=tmpfs_mb, seconds=clip * megapixels * 0.4 + 2)
+
+@dataclass(eq=False)
+class _Ticket:
+    owner: Hashable
+    cost: JobCost
+    tag: float
+    enqueued: float = field(default_factory=time.monotonic)
+    admitted: asyncio.Event = field(default_factory=asyncio.Event)
+
+class JobScheduler:
+    """
+    Admits jobs while their estimated costs fit the machine.
+
+    Queued jobs are ordered by start-time fair queuing: each owner (guild, user)
+    advances its own virtual clock by the estimated runtime of its jobs, so one
+    user submitting many heavy jobs cannot starve others, and short jobs sort
+    ahead of long ones. A queued job that does not fit may be passed by smaller
+    jobs that do, until it has waited MAX_BACKFILL_WAIT seconds.
+    """
+    def __init__(self, cpus: int, ram_mb: int, tmpfs_mb: int):
+        self.capacity = JobCost(cpus, ram_mb, tmpfs_mb, 0)
+        self.free = JobCost(cpus, ram_mb, tmpfs_mb, 0)
+        self._queue: List[_Ticket] = []
+        self._running: List[_Ticket] = []
+        self._vtime = 0.0
+        self._owner_tags = {}
+        self._waits = deque(maxlen=100)
+
+    def _clamp(self, cost: JobCost) -> JobCost:
+        # A job bigger than the machine still runs, alone
+        return JobCost(
+            min(cost.cpus, self.capacity.cpus), min(cost.ram_mb, self.capacity.ram_mb),
+            min(cost.tmpfs_mb, self.capacity.tmpfs_mb), cost.seconds
+        )
+
+    def _enqueue(self, owner: Hashable, cost: JobCost) -> _Ticket:
+        start = max(self._vtime, self._owner_tags.get(owner, 0.0))
+        tag = start + max(cost.seconds, 1.0)
+        self._owner_tags[owner] = tag
+        ticket = _Ticket(owner, self._clamp(cost), tag)
+        self._queue.append(ticket)
+        self._queue.sort(key=lambda t: t.tag)
+        return ticket
+
+    def _take(self, ticket: _Ticket):
+        self.free.cpus -= ticket.cost.cpus
+        self.free.ram_mb -= ticket.cost.ram_mb
+        self.free.tmpfs_mb -= ticket.cost.tmpfs_mb
+
+    def _give(self, ticket: _Ticket):
+        self.free.cpus += ticket.cost.cpus
+        self.free.ram_mb += ticket.cost.ram_mb
+        self.free.tmpfs_mb += ticket.cost.tmpfs_mb
+
+    def _dispatch(self):
+        now = time.monotonic()
+        for ticket in list(self._queue):
+            if ticket.cost.fits(self.free):
+                self._queue.remove(ticket)
+                self._running.append(ticket)
+                self._take(ticket)
+                self._vtime = max(self._vtime, ticket.tag - max(ticket.cost.seconds, 1.0))
+                self._waits.append(now - ticket.enqueued)
+                ticket.admitted.set()
+            elif now - ticket.enqueued > MAX_BACKFILL_WAIT:
+                # Stop letting smaller jobs jump a job that has waited too long
+                break
+
+    def _release(self, ticket: _Ticket):
+        if ticket in self._running:
+            self._running.remove(ticket)
+            self._give(ticket)
+        elif ticket in self._queue:
+            self._queue.remove(ticket)
+        self._dispatch()
+
+    def position(self, ticket: _Ticket) -> int:
+        """1-based queue position, or 0 once the job is running."""
+        return self._queue.index(ticket) + 1 if ticket in self._queue else 0
+
+    async def run(self, owner: Hashable, cost: JobCost, func: Callable[[], Awaitable[Any]],
+                  on_position: Optional[Callable[[int], Awaitable[None]]] = None) -> Any:
+        """Waits for admission, awaits `func()`, and frees the job's resources afterwards."""
+        ticket = self._enqueue(owner, cost)
+        self._dispatch()
+        try:
+            last_position = None
+            while not ticket.admitted.is_set():
+                position = self.position(ticket)
+                if on_position and position != last_position:
+                    await on_position(position)
+                last_position = position
+                try:
+                    await asyncio.wait_for(ticket.admitted.wait(), QUEUE_POSITION_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+            logging.info(f"Job admitted for {ticket.owner} with {ticket.cost} ({self.stats()})")
+            return await func()
+        finally:
+            self._release(ticket)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            'queued': len(self._queue),
+            'running': len(self._running),
+            'free_cpus': self.free.cpus,
+            'free_ram_mb': self.free.ram_mb,
+            'free_tmpfs_mb': self.free.tmpfs_mb,
+            'avg_wait': sum(self._waits) / len(self._waits) if self._waits else 0.0,
+            'oldest_wait': max((now - t.enqueued for t in self._queue), default=0.0),
+        }
@@ -0,0 +1,101 @@
+import os
+import logging
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+from lib.stream import run_ffmpeg
+
+def split_segments(keyframes: List[float], start: float, duration: float,
+                   count: int, min_length: float) -> List[Tuple[float, float]]:
+    """
+    Cuts [start, start + duration) into up to `count` (start, end) pieces.
+    Inner cuts land on the source keyframe closest to an even split, so each
+    segment's input seek starts decoding right where it begins. Cuts that would
+    leave a piece shorter than `min_length` are skipped.
+    """
+    end = start + duration
+    cuts = [start]
+    for i in range(1, count):
+        ideal = start + duration * i / count
+        candidates = [k for k in keyframes if cuts[-1] + min_length <= k <= end - min_length]
+        if candidates:
+            cuts.append(min(candidates, key=lambda k: abs(k - ideal)))
+    cuts.append(end)
+    return list(zip(cuts, cuts[1:]))
+
+def _run(cmd: List[str], on_start=None, on_progress=None):
+    try:
+        run_ffmpeg(cmd, on_progress=on_progress, on_start=on_start)
+    except subprocess.CalledProcessError as e:
+        logging.error(f"FFmpeg error: {e.stderr.decode() if e.stderr else str(e)}")
+        raise
+
+def encode_segments(input_path: str, output_path: str, segments: List[Tuple[float, float]],
+                    video_args: List[str], audio_args: Optional[List[str]], vf: Optional[str],
+                    threads_per_segment: int, scratch_prefix: str,
+                    on_start: Optional[Callable[[subprocess.Popen], None]] = None,
+                    on_progress: Optional[Callable[[float], None]] = None):
+    """
+    Encodes each segment's video in its own ffmpeg process, all at once, while
+    one more process encodes the audio for the whole range (joined AAC frames
+    would click at every seam). The pieces are then joined with the concat
+    demuxer and muxed with the audio without re-encoding. Every segment gets the
+    same `video_args`, so a -maxrate cap holds for the joined output too.
+    Temporary files are named `scratch_prefix` + suffix and removed afterwards.
+    `on_start` receives every ffmpeg process; `on_progress` gets the seconds of
+    video encoded so far across all segments, and may raise to stop them all.
+    """
+    start, end = segments[0][0], segments[-1][1]
+    parts = [f"{scratch_prefix}_seg{i}.mp4" for i in range(len(segments))]
+    audio_path = f"{scratch_prefix}_audio.m4a" if audio_args else None
+    list_path = f"{scratch_prefix}_segments.txt"
+
+    commands = []
+    for (seg_start, seg_end), part in zip(segments, parts):
+        cmd = ['ffmpeg', '-ss', f"{seg_start:.3f}", '-t', f"{seg_end - seg_start:.3f}", '-i', input_path,
+               '-map', '0:v:0', '-an']
+        if vf: cmd += ['-vf', vf]
+        cmd += [*video_args, '-threads', str(threads_per_segment), '-y', part]
+        commands.append(cmd)
+    if audio_path:
+        commands.append(['ffmpeg', '-ss', f"{start:.3f}", '-t', f"{end - start:.3f}", '-i', input_path,
+                         '-map', '0:a:0', '-vn', *audio_args, '-y', audio_path])
+
+    encoded = [0.0] * len(segments)
+    lock = threading.Lock()
+
+    def progress_for(index: int):
+        def update(values: dict):
+            try:
+                seconds = int(values.get('out_time_us', '')) / 1e6
+            except ValueError:
+                return
+            with lock:
+                encoded[index] = max(seconds, 0.0)
+                total = sum(encoded)
+            if on_progress:
+                on_progress(total)
+        return update
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(commands)) as pool:
+            futures = [
+                pool.submit(_run, cmd, on_start, progress_for(i) if i < len(segments) else None)
+                for i, cmd in enumerate(commands)
+            ]
+            # Re-raises the first failure
+            for future in futures:
+                future.result()
+
+        with open(list_path, 'w') as f:
+            f.writelines(f"file '{os.path.abspath(part)}'\n" for part in parts)
+        cmd = ['ffmpeg', '-f', 'concat', '-safe', '0', '-i', list_path]
+        if audio_path:
+            cmd += ['-i', audio_path, '-map', '0:v', '-map', '1:a']
+        cmd += ['-c', 'copy', '-movflags', '+faststart', '-y', output_path]
+        _run(cmd, on_start)
+    finally:
+        for path in [*parts, audio_path, list_path]:
+            if path and os.path.exists(path):
+                os.remove(path)
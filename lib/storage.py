@@ -0,0 +1,131 @@
+import os
+import time
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Tuple, Iterable
+from lib.utils import remove_job_files, JOB_PREFIX
+
+@dataclass
+class Reservation:
+    job_id: str
+    folder: str
+    reserved: int
+    used: int = 0
+
+class StorageManager:
+    """
+    Byte accounting for job scratch space.
+
+    Every job reserves its estimated footprint (source + output + scratch) before
+    it starts. A background thread measures the job's files and grows the
+    reservation if they outgrow it. Jobs that do not fit wait for other
+    reservations to be released, or move to a disk-backed spill folder.
+    Releasing a reservation deletes the job's remaining files, including those
+    in the `untracked` folders, which hold job files that are not reserved
+    against (the persistent source folder).
+    """
+    def __init__(self, tiers: List[Tuple[str, int]], wait: float, poll_interval: float,
+                 untracked: Iterable[str] = ()):
+        self.tiers = [(folder, capacity) for folder, capacity in tiers if folder]
+        self.untracked = [folder for folder in untracked if folder]
+        self.wait = wait
+        self.poll_interval = poll_interval
+        self._reservations: Dict[str, Reservation] = {}
+        self._cond = threading.Condition()
+        for folder in [folder for folder, _ in self.tiers] + self.untracked:
+            os.makedirs(folder, exist_ok=True)
+        threading.Thread(target=self._monitor, daemon=True).start()
+
+    def _reserved(self, folder: str) -> int:
+        return sum(r.reserved for r in self._reservations.values() if r.folder == folder)
+
+    def _fits(self, folder: str, capacity: int, size: int) -> bool:
+        # A job bigger than the whole tier may still run there alone
+        reserved = self._reserved(folder)
+        return reserved + size <= capacity or (reserved == 0 and folder == self.tiers[-1][0])
+
+    def reserve(self, job_id: str, size: int) -> str:
+        """
+        Blocks until `size` bytes are reserved for `job_id` and returns the folder
+        the job should write to. Waits up to `wait` seconds for the primary tier
+        before spilling to the next one, then waits on whatever frees first.
+        """
+        deadline = time.monotonic() + self.wait
+        with self._cond:
+            while True:
+                primary = self.tiers[0][0]
+                candidates = self.tiers if time.monotonic() >= deadline else self.tiers[:1]
+                for folder, capacity in candidates:
+                    if self._fits(folder, capacity, size):
+                        self._reservations[job_id] = Reservation(job_id, folder, size)
+                        if folder != primary:
+                            logging.info(f"Storage for {job_id} spilled to {folder}.")
+                        logging.info(f"Reserved {size / (1024 * 1024):.0f}MB for {job_id} ({self.stats()})")
+                        return folder
+                self._cond.wait(max(deadline - time.monotonic(), self.poll_interval))
+
+    def release(self, job_id: str):
+        """Deletes the job's remaining files and frees its reservation."""
+        with self._cond:
+            reservation = self._reservations.pop(job_id, None)
+            self._cond.notify_all()
+        if reservation:
+            remove_job_files(reservation.folder, job_id)
+        for folder in self.untracked:
+            remove_job_files(folder, job_id)
+
+    def _measure(self, reservation: Reservation) -> int:
+        total = 0
+        try:
+            for entry in os.scandir(reservation.folder):
+                if entry.name.startswith(reservation.job_id) and entry.is_file():
+                    total += entry.stat().st_size
+        except FileNotFoundError:
+            pass
+        return total
+
+    def _monitor(self):
+        while True:
+            time.sleep(self.poll_interval)
+            with self._cond:
+                reservations = list(self._reservations.values())
+            for reservation in reservations:
+                used = self._measure(reservation)
+                with self._cond:
+                    reservation.used = used
+                    if used > reservation.reserved:
+                        logging.warning(
+                            f"{reservation.job_id} uses {used / (1024 * 1024):.0f}MB, "
+                            f"over its {reservation.reserved / (1024 * 1024):.0f}MB reservation; growing it."
+                        )
+                        reservation.reserved = used
+
+    def sweep_orphans(self, min_age: float = 0, keep: Iterable[str] = ()):
+        """
+        Removes job files with no live reservation, leaving anything younger than
+        `min_age` seconds and the files of the jobs in `keep` (journaled jobs waiting
+        to resume).
+        """
+        now = time.time()
+        with self._cond:
+            active = set(self._reservations) | set(keep)
+        for folder in [folder for folder, _ in self.tiers] + self.untracked:
+            for entry in os.scandir(folder):
+                if not entry.is_file() or not entry.name.startswith(JOB_PREFIX):
+                    continue
+                if any(entry.name.startswith(job_id) for job_id in active):
+                    continue
+                if now - entry.stat().st_mtime >= min_age:
+                    logging.info(f"Removing orphaned file {entry.path}")
+                    os.remove(entry.path)
+
+    def stats(self) -> dict:
+        return {
+            folder: {
+                'reserved_mb': self._reserved(folder) // (1024 * 1024),
+                'used_mb': sum(r.used for r in self._reservations.values() if r.folder == folder) // (1024 * 1024),
+                'capacity_mb': capacity // (1024 * 1024),
+            }
+            for folder, capacity in self.tiers
+        }
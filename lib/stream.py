@@ -0,0 +1,131 @@
+import logging
+import resource
+import threading
+import subprocess
+from typing import List, BinaryIO, Tuple, Optional, Callable
+from lib.utils import STREAM_CHUNK_BYTES
+
+# Containers whose index can sit after the media data, which a pipe cannot seek to
+ISO_BMFF_EXTS = ("mp4", "m4v", "m4a", "mov", "3gp")
+
+def is_streamable(head: bytes, ext: str) -> bool:
+    """
+    True when a source starting with `head` can be demuxed from a pipe.
+    For MP4-family files that means the moov atom comes before mdat (faststart).
+    """
+    if ext not in ISO_BMFF_EXTS:
+        return True
+    pos = 0
+    while pos + 8 <= len(head):
+        size = int.from_bytes(head[pos:pos + 4], 'big')
+        kind = head[pos + 4:pos + 8]
+        if kind == b'moov':
+            return True
+        if kind == b'mdat':
+            return False
+        if size == 1 and pos + 16 <= len(head):
+            size = int.from_bytes(head[pos + 8:pos + 16], 'big')
+        if size < 8:
+            return False
+        pos += size
+    # Index not found within the peeked bytes; do not risk it
+    return False
+
+def _child_limits():
+    """
+    preexec_fn for ffmpeg/ffprobe: restores the address space limit a worker set
+    for itself (see lib.workers). Multi-threaded x264 maps several GiB of virtual
+    memory at 1080p and fails under the worker's cap; RLIMIT_CPU still applies.
+    """
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    resource.setrlimit(resource.RLIMIT_AS, (hard, hard))
+
+def _pump(head: bytes, source: BinaryIO, sink: BinaryIO, counter: list):
+    try:
+        sink.write(head)
+        counter[0] += len(head)
+        while True:
+            chunk = source.read(STREAM_CHUNK_BYTES)
+            if not chunk:
+                break
+            sink.write(chunk)
+            counter[0] += len(chunk)
+    except (BrokenPipeError, ValueError):
+        # ffmpeg stopped reading early (e.g. -t reached); that is not an error
+        pass
+    finally:
+        try:
+            sink.close()
+        except BrokenPipeError:
+            pass
+
+def _parse_progress(stdout: BinaryIO, on_progress: Optional[Callable[[dict], None]]):
+    """Reads `-progress` key=value lines and hands each completed block to `on_progress`."""
+    block = {}
+    for line in stdout:
+        key, _, value = line.decode(errors='replace').strip().partition('=')
+        block[key] = value
+        if key == 'progress':
+            if on_progress:
+                on_progress(block)
+            block = {}
+
+def run_ffmpeg(cmd: List[str], head: Optional[bytes] = None, source: Optional[BinaryIO] = None,
+               on_progress: Optional[Callable[[dict], None]] = None,
+               on_start: Optional[Callable[[subprocess.Popen], None]] = None) -> Tuple[int, bytes]:
+    """
+    Runs an ffmpeg command with `-progress pipe:1`, calling `on_progress` with every
+    progress block (out_time_us, speed, progress=continue|end, ...). With a `source`,
+    the command reads `pipe:0` and is fed `head` and then the rest of `source` while
+    it encodes. `on_start` receives the process, e.g. so it can be killed on cancel;
+    an exception raised by `on_progress` kills it too.
+    Returns the number of bytes fed and ffmpeg's stderr.
+    Raises CalledProcessError like subprocess.run(check=True).
+    """
+    cmd = [cmd[0], '-progress', 'pipe:1', '-nostats', *cmd[1:]]
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE if source else subprocess.DEVNULL,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, preexec_fn=_child_limits)
+    if on_start:
+        on_start(proc)
+    counter = [0]
+    stderr = []
+    threads = [threading.Thread(target=lambda: stderr.append(proc.stderr.read()), daemon=True)]
+    if source:
+        threads.append(threading.Thread(target=_pump, args=(head or b'', source, proc.stdin, counter), daemon=True))
+    for thread in threads:
+        thread.start()
+    try:
+        _parse_progress(proc.stdout, on_progress)
+        proc.wait()
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        for thread in threads:
+            thread.join()
+    stderr = stderr[0] if stderr else b''
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, stderr=stderr)
+    if source:
+        logging.info(f"Streamed {counter[0] / (1024 * 1024):.1f}MB straight into ffmpeg.")
+    return counter[0], stderr
+
+def run_tracked(cmd: List[str], on_start: Optional[Callable[[subprocess.Popen], None]] = None) -> bytes:
+    """
+    Runs a short ffprobe/ffmpeg command to completion and returns its stdout.
+    `on_start` receives the process, as with run_ffmpeg.
+    Raises CalledProcessError like subprocess.run(check=True).
+    """
+    proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, preexec_fn=_child_limits)
+    if on_start:
+        on_start(proc)
+    try:
+        stdout, stderr = proc.communicate()
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, output=stdout, stderr=stderr)
+    return stdout
@@ -4,14 +4,69 @@ import os
 
 SUPPORTED_FORMATS = ("mp4", "mp3", "gif")
 MAX_SIZE_MB = 10  # Discord's limit for non-boosted servers
-MAX_GIF_FRAMES = 50
+MAX_GIF_FRAMES = 300  # Frame budget per GIF (20s at 15fps); fps is lowered for longer clips
 MAX_GIF_LENGTH = 30 # seconds
 MAX_VIDEO_RESOLUTION = 1920
 SAFE_GIF_WIDTH = 320    # Downscale GIFs to this width
 SAFE_GIF_FPS = 15       # Cap GIF framerate
 MAX_GIF_LENGTH = 30     # Max seconds for a GIF
+GIF_STATS_MODE = "diff"  # palettegen stats_mode; favours moving parts over static background
+GIF_DITHER = "bayer"     # paletteuse dither; ordered dithering compresses far better than error diffusion
+GIF_BAYER_SCALE = 5
+GIF_SAMPLE_COUNT = 3       # Windows encoded to measure a clip's GIF bytes per pixel
+GIF_SAMPLE_SECONDS = 1.0
+GIF_SIZE_MARGIN = 0.85     # Fraction of MAX_SIZE_MB a predicted GIF may use
+AUDIO_BITRATE_KBPS = 128   # Default audio bitrate for mp4/mp3 outputs
+MIN_VIDEO_KBPS = 100       # Below this a size-budgeted mp4 is not worth encoding
+MIN_AUDIO_KBPS = 32        # Likewise for mp3; about 40 minutes fit in MAX_SIZE_MB
+CONTAINER_OVERHEAD = 0.03  # Fraction of the size budget reserved for muxing overhead
+MAX_ENCODE_ATTEMPTS = 2    # Budgeted encode + one corrective pass
+SEGMENT_MIN_CLIP = 40      # Shorter mp4 clips encode in a single ffmpeg process
+SEGMENT_MIN_LENGTH = 10    # Seconds; shorter pieces cost more in seams than they save
+MAX_SEGMENTS = 4           # Concurrent segment encoders per job, further capped by its CPU share
+KEYFRAME_TOLERANCE = 0.5  # Seconds a stream-copy cut may start early to land on a keyframe
+RANGE_KEYFRAME_MARGIN = 3  # Seconds fetched either side of a trimmed range
+MAX_RANGED_SECONDS = 600   # Longer ranges fall back to a size-limited full download
+SCHEDULER_CPUS = os.cpu_count() or 4
+SCHEDULER_RAM_MB = 768     # Container limit minus the bot's own footprint
+SCHEDULER_CPU_OVERCOMMIT = 2  # Admitted jobs spend part of their time fetching; the encode pool caps real CPU use
+MAX_BACKFILL_WAIT = 60     # Seconds before smaller jobs may no longer pass a queued job
+QUEUE_POSITION_INTERVAL = 5  # Seconds between queue position updates
+WORKER_COUNT = max(2, SCHEDULER_CPUS // 2)  # Encode worker processes; each ffmpeg runs 1-4 threads
+FETCH_WORKER_COUNT = 3       # Concurrent source downloads
+HANDOFF_SLOTS = 2            # Fetched sources allowed to wait for an encoder
+WORKER_MEMORY_MB = 1024      # RLIMIT_AS per worker and each of its ffmpeg children
+WORKER_CPU_SECONDS = 600     # RLIMIT_CPU budget per job
+WORKER_JOB_TIMEOUT = 900     # Wall-clock seconds before a job's worker is killed
+CANCEL_GRACE = 10            # Seconds a worker gets to stop a cancelled job before it is killed
+PROGRESS_INTERVAL = 3        # Seconds between progress message edits
+LATENCY_TARGET = 90          # Seconds from admission to a finished encode the quality controller aims for
+X264_PRESET = "fast"         # Used when no quality controller picked one
+MAX_SOURCE_MB = 100          # Largest source we are willing to download
+SOURCE_FORMAT = "bestvideo[ext=mp4][vcodec!*=av01]+bestaudio/best"
+YDL_IDLE_SESSIONS = 4        # Warm YoutubeDL sessions kept per option profile and process
+PREFLIGHT_TTL = 10 * 60      # seconds; format URLs from extractors expire after a while
+STREAM_PEEK_BYTES = 256 * 1024  # Read before deciding whether a source can be piped
+STREAM_CHUNK_BYTES = 256 * 1024
+STORAGE_TMPFS_MB = 160       # Ramdisk bytes jobs may reserve (the rest is the result cache)
+STORAGE_SPILL_FOLDER = os.getenv("STORAGE_SPILL_FOLDER")  # Optional disk scratch, unset to disable
+STORAGE_SPILL_MB = 2048
+SOURCE_FOLDER = os.getenv("SOURCE_FOLDER", "")  # Opt-in persistent folder for downloads, so .part files survive restarts; empty keeps them in scratch
+STORAGE_WAIT = 30            # Seconds to wait for ramdisk space before spilling
+STORAGE_POLL_INTERVAL = 1    # Seconds between job file size measurements
+ORPHAN_MIN_AGE = 10 * 60     # Unreserved job files older than this are swept
+JOB_PREFIX = "job_"
+JOURNAL_PATH = os.getenv("JOURNAL_PATH", "data/jobs.sqlite3")  # On a persistent volume, see docker-compose.yml
+JOURNAL_MAX_ATTEMPTS = 3     # Restarts a job may survive before it is dropped instead of requeued
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))  # Prometheus scrape port, 0 to disable
 KNOWN_KEYS = ('format', 'start', 'end', 'resolution', 'framerate')
 DOWNLOAD_FOLDER = "/mnt/ramdisk"
+CACHE_FOLDER = os.path.join(DOWNLOAD_FOLDER, "cache")
+CACHE_MAX_BYTES = 96 * 1024 * 1024    # Share of the 256MB tmpfs kept for finished results
+CACHE_SPILL_FOLDER = os.getenv("CACHE_SPILL_FOLDER")  # Optional disk tier, unset to disable
+CACHE_SPILL_MAX_BYTES = 1024 * 1024 * 1024
+CACHE_TTL = 6 * 60 * 60               # seconds
 
 # --- New Error Classes ---
 class VideoDownloadError(Exception):
@@ -24,6 +79,10 @@ class VideoSourceTooLarge(VideoDownloadError):
         self.message = message
         super().__init__(self.message)
 
+class JobCancelled(VideoDownloadError):
+    """The requester cancelled the job, or nobody is waiting for its result any more."""
+    pass
+
 class VideoOutputTooLarge(VideoDownloadError):
     """Error 1002: The processed video is still above the limit."""
     def __init__(self, message="Video result is above 10MB limit (Error 1002)"):
@@ -42,6 +101,15 @@ def remove_files():
         if file.endswith(SUPPORTED_FORMATS):
             os.remove(os.path.join(DOWNLOAD_FOLDER, file))
 
+def remove_job_files(folder, job_name):
+    # Remove every temp file a job created; they all share its output_name prefix
+    if not job_name or not os.path.isdir(folder):
+        return
+    for file in os.listdir(folder):
+        path = os.path.join(folder, file)
+        if file.startswith(job_name) and os.path.isfile(path):
+            os.remove(path)
+
 def remove_file(file_path):
     if os.path.isfile(file_path): # Removed extension check to allow removing temp files safely
         os.remove(file_path)
@@ -84,4 +152,15 @@ def seconds_to_hhmmss(seconds):
     if seconds is None:
         return None
     import datetime
-    return str(datetime.timedelta(seconds=int(seconds)))
\ No newline at end of file
+    return str(datetime.timedelta(seconds=int(seconds)))
+
+def hhmmss_to_seconds(timestamp):
+    """
+    Inverse of seconds_to_hhmmss. Accepts "SS", "MM:SS" or "H:MM:SS".
+    """
+    if timestamp is None:
+        return None
+    seconds = 0.0
+    for part in str(timestamp).split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
\ No newline at end of file
@@ -0,0 +1,241 @@
+import os
+import time
+import queue
+import pickle
+import signal
+import logging
+import resource
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from dataclasses import asdict
+from lib.utils import VideoDownloadError, JobCancelled, remove_job_files, CANCEL_GRACE
+
+class WorkerCrashed(VideoDownloadError):
+    """A worker process died (rlimit, OOM kill, segfault) while running a job."""
+    pass
+
+class JobTimeout(VideoDownloadError):
+    """A job exceeded its wall-clock limit and its worker was killed."""
+    pass
+
+def _apply_limits(memory_mb: int, cpu_seconds: int):
+    """
+    Caps the worker's address space and CPU time. Children inherit both at fork;
+    the address space cap is only a soft limit, which lib.stream lifts again for
+    ffmpeg since x264 reserves far more virtual memory per thread than it uses.
+    """
+    limit = memory_mb * 1024 * 1024
+    _, hard_as = resource.getrlimit(resource.RLIMIT_AS)
+    if hard_as != resource.RLIM_INFINITY:
+        limit = min(limit, hard_as)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard_as))
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    used = int(usage.ru_utime + usage.ru_stime)
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = used + cpu_seconds
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+def _worker_main(conn, cancel, download_dir: str, memory_mb: int, cpu_seconds: int):
+    # Own process group, so a timeout can kill the worker together with its ffmpeg
+    os.setpgrp()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from lib.download import VideoDownloader, VideoJob, JobControl, SESSIONS
+    # Pay for the yt-dlp import and session setup once per worker, not per job
+    SESSIONS.prewarm('download')
+    from lib.metrics import JobTrace
+
+    downloader = VideoDownloader(download_dir=download_dir)
+    while True:
+        try:
+            stage, fields, args = conn.recv()
+        except EOFError:
+            return
+        job = VideoJob(**fields)
+        _apply_limits(memory_mb, cpu_seconds)
+        downloader.trace = JobTrace(job.output_name)
+        # Progress goes back over the pipe ahead of the result; `cancel` is set by WorkerPool
+        downloader.control = JobControl(
+            on_progress=lambda stage, fraction: conn.send(('progress', stage, fraction)), cancel_event=cancel
+        )
+        try:
+            if stage == 'fetch':
+                # The fetch may shift the job's trim, so the encode stage needs the updated job
+                result = (asdict(job), downloader.fetch(job))
+            elif stage == 'encode':
+                result = downloader.encode(job, *args)
+            else:
+                result = downloader._run_pipeline(job)
+            conn.send(('ok', result, downloader.trace.to_dict()))
+        except BaseException as e:
+            remove_job_files(job.work_dir or download_dir, job.output_name)
+            if job.source_dir:
+                remove_job_files(job.source_dir, job.output_name)
+            try:
+                pickle.dumps(e)
+            except Exception:
+                e = RuntimeError(f"{type(e).__name__}: {e}")
+            conn.send(('error', e, downloader.trace.to_dict()))
+
+class _Worker:
+    def __init__(self, ctx, download_dir: str, memory_mb: int, cpu_seconds: int):
+        self.conn, child_conn = ctx.Pipe()
+        self.cancel = ctx.Event()
+        self.process = ctx.Process(
+            target=_worker_main, args=(child_conn, self.cancel, download_dir, memory_mb, cpu_seconds), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.alive = True
+
+    def kill(self):
+        self.alive = False
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            self.process.kill()
+        self.process.join(5)
+        self.conn.close()
+
+class WorkerPool:
+    """
+    Runs VideoDownloader stages in separate worker processes.
+
+    Each worker keeps a warm yt-dlp session and serves one call at a time over a pipe.
+    Jobs run under RLIMIT_AS / RLIMIT_CPU and a wall-clock timeout; a worker that
+    dies or times out is killed with its process group, its job's temp files are
+    removed, and a fresh worker takes its slot.
+    """
+    def __init__(self, size: int, download_dir: str, memory_mb: int, cpu_seconds: int, timeout: float,
+                 name: str = "transcoding"):
+        self.size = size
+        self.name = name
+        self.download_dir = download_dir
+        self.memory_mb = memory_mb
+        self.cpu_seconds = cpu_seconds
+        self.timeout = timeout
+        self.respawns = 0
+        self._ctx = multiprocessing.get_context("spawn")
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._started = False
+        self._lock = threading.Lock()
+        self._started_at = time.monotonic()
+        self._busy_seconds = 0.0
+        self._active = {}  # worker -> monotonic start of its current call
+
+    def _spawn(self) -> _Worker:
+        return _Worker(self._ctx, self.download_dir, self.memory_mb, self.cpu_seconds)
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            for _ in range(self.size):
+                self._idle.put(self._spawn())
+            self._started = True
+            self._started_at = time.monotonic()
+        logging.info(f"Started {self.size} {self.name} workers.")
+
+    def _replace(self, worker: _Worker, job):
+        worker.kill()
+        remove_job_files(job.work_dir or self.download_dir, job.output_name)
+        if job.source_dir:
+            remove_job_files(job.source_dir, job.output_name)
+        self.respawns += 1
+        self._idle.put(self._spawn())
+
+    @contextmanager
+    def acquire(self):
+        """Checks out an idle worker, blocking until one is free."""
+        self.start()
+        worker = self._idle.get()
+        try:
+            yield worker
+        finally:
+            # A killed worker was already replaced by a fresh one
+            if worker.alive:
+                self._idle.put(worker)
+
+    def _receive(self, worker: _Worker, job, deadline: float, control=None):
+        """
+        Waits for the worker's result, relaying progress messages to `control`.
+        A cancelled job is passed on to the worker, which gets CANCEL_GRACE seconds
+        to stop before it is killed.
+        """
+        cancel_deadline = None
+        while True:
+            now = time.monotonic()
+            if control is not None and control.cancelled and cancel_deadline is None:
+                worker.cancel.set()
+                cancel_deadline = now + CANCEL_GRACE
+            if cancel_deadline is not None and now >= cancel_deadline:
+                self._replace(worker, job)
+                raise JobCancelled("Job was cancelled.")
+            if now >= deadline:
+                self._replace(worker, job)
+                raise JobTimeout(f"Job exceeded {self.timeout:.0f}s and was stopped.")
+            if not worker.conn.poll(min(deadline - now, 0.5)):
+                continue
+            message = worker.conn.recv()
+            if message[0] == 'progress':
+                if control is not None:
+                    control.report(*message[1:])
+                continue
+            return message
+
+    def call(self, worker: _Worker, stage: str, job, trace=None, *args, control=None):
+        """
+        Blocking: runs one stage ('fetch', 'encode' or 'pipeline') of `job` on a
+        checked-out worker and returns its result. Spans the worker recorded are
+        merged into `trace`; progress and cancellation go through `control`.
+        """
+        started = time.monotonic()
+        with self._lock:
+            self._active[worker] = started
+        try:
+            worker.cancel.clear()
+            worker.conn.send((stage, asdict(job), args))
+            status, payload, worker_trace = self._receive(worker, job, started + self.timeout, control)
+        except (EOFError, OSError, BrokenPipeError):
+            code = worker.process.exitcode
+            self._replace(worker, job)
+            raise WorkerCrashed(f"Worker died while processing (exit code {code}).")
+        finally:
+            with self._lock:
+                self._busy_seconds += time.monotonic() - self._active.pop(worker)
+
+        if trace is not None:
+            trace.merge(worker_trace)
+        logging.info(f"{self.name.capitalize()} worker finished {stage} of {job.output_name} "
+                     f"in {time.monotonic() - started:.1f}s.")
+        if status == 'error':
+            raise payload
+        return payload
+
+    def run(self, job, trace=None, control=None) -> str:
+        """Blocking: runs the whole pipeline for `job` on an idle worker and returns the output path."""
+        with self.acquire() as worker:
+            return self.call(worker, 'pipeline', job, trace, control=control)
+
+    def utilization(self) -> float:
+        """Fraction of worker time spent busy since the pool started."""
+        now = time.monotonic()
+        with self._lock:
+            busy = self._busy_seconds + sum(now - started for started in self._active.values())
+        elapsed = (now - self._started_at) * self.size
+        return busy / elapsed if elapsed > 0 else 0.0
+
+    def stats(self) -> dict:
+        with self._lock:
+            busy = len(self._active)
+        return {'size': self.size, 'busy': busy, 'utilization': self.utilization(), 'respawns': self.respawns}
+
+    def shutdown(self):
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            worker.kill()
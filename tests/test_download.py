@@ -0,0 +1,80 @@
+import shutil
+import pytest
+from lib.download import VideoDownloader, VideoJob, FetchedSource, JobControl
+from lib.encode import EncodePlan
+from lib.utils import MAX_GIF_LENGTH, MAX_GIF_FRAMES, MAX_SIZE_MB, JobCancelled
+
+META = {
+    'width': 1280, 'height': 720, 'duration': 600.0, 'bitrate': 2_000_000,
+    'video_codec': 'h264', 'audio_codec': 'aac', 'pix_fmt': 'yuv420p', 'keyframes': []
+}
+
+@pytest.fixture
+def commands(tmp_path, monkeypatch):
+    ran = []
+    monkeypatch.setattr(VideoDownloader, '_run_ffmpeg', lambda self, cmd, source=None, duration=0: ran.append(cmd))
+    return ran
+
+def _duration_arg(cmd):
+    return cmd[cmd.index('-t') + 1]
+
+def test_ranged_gif_is_clipped_to_max_length(tmp_path, commands):
+    downloader = VideoDownloader(str(tmp_path))
+    job = VideoJob("https://example.com/v", format="gif", start_time="00:00:10", end_time="00:01:30")
+    downloader._process("in.mp4", "out.gif", job, meta=dict(META))
+    assert float(_duration_arg(commands[0])) == MAX_GIF_LENGTH
+
+def test_short_ranged_gif_keeps_its_range(tmp_path, commands):
+    downloader = VideoDownloader(str(tmp_path))
+    job = VideoJob("https://example.com/v", format="gif", start_time="00:00:10", end_time="00:00:20")
+    downloader._process("in.mp4", "out.gif", job, meta=dict(META))
+    assert float(_duration_arg(commands[0])) == 10
+
+def test_unplanned_gif_stays_within_frame_budget(tmp_path, commands):
+    downloader = VideoDownloader(str(tmp_path))
+    job = VideoJob("https://example.com/v", format="gif")
+    downloader._process("in.mp4", "out.gif", job, meta=dict(META))
+    assert job.framerate * MAX_GIF_LENGTH <= MAX_GIF_FRAMES
+
+def _audio_meta(bitrate, duration):
+    return dict(META, width=0, height=0, video_codec=None, audio_codec='mp3', bitrate=bitrate, duration=duration)
+
+def test_mp3_is_copied_when_it_fits(tmp_path, commands):
+    downloader = VideoDownloader(str(tmp_path))
+    job = VideoJob("https://example.com/v", format="mp3")
+    downloader._process("in.mp3", "out.mp3", job, EncodePlan(), meta=_audio_meta(128_000, 300))
+    assert commands[0][commands[0].index('-c:a') + 1] == 'copy'
+
+def test_mp3_over_the_limit_is_reencoded(tmp_path, commands):
+    downloader = VideoDownloader(str(tmp_path))
+    job = VideoJob("https://example.com/v", format="mp3")
+    downloader._process("in.mp3", "out.mp3", job, EncodePlan(), meta=_audio_meta(320_000, 300))
+    assert commands[0][commands[0].index('-c:a') + 1] == 'libmp3lame'
+
+def test_oversized_mp3_retries_at_a_lower_bitrate(tmp_path, monkeypatch):
+    downloader = VideoDownloader(str(tmp_path))
+    source = tmp_path / "source.mp3"
+    source.write_bytes(b"")
+    bitrates = []
+
+    def fake_process(self, input_path, output_path, job, plan=None, meta=None, source=None):
+        # About 0.1MB per kbps, so the planned 128kbps overshoots
+        bitrates.append(plan.audio_kbps)
+        with open(output_path, 'wb') as f:
+            f.truncate(plan.audio_kbps * 100 * 1024)
+        return output_path
+
+    monkeypatch.setattr(VideoDownloader, '_plan', lambda self, path, job, allow_copy=True: EncodePlan())
+    monkeypatch.setattr(VideoDownloader, '_process', fake_process)
+    job = VideoJob("https://example.com/v", format="mp3", work_dir=str(tmp_path))
+    output = downloader.encode(job, FetchedSource(str(source), 0, 0))
+    assert len(bitrates) == 2 and bitrates[1] < bitrates[0]
+    assert (tmp_path / output).stat().st_size <= MAX_SIZE_MB * 1024 * 1024
+
+@pytest.mark.skipif(shutil.which('sleep') is None, reason="sleep is not available")
+def test_cancel_kills_tracked_commands(tmp_path):
+    control = JobControl()
+    control.cancel()
+    downloader = VideoDownloader(str(tmp_path), control=control)
+    with pytest.raises(JobCancelled):
+        downloader._run_tracked(['sleep', '30'])
@@ -0,0 +1,16 @@
+from lib.formats import select_source
+
+def _video(format_id, height, **size):
+    return dict(format_id=format_id, height=height, width=height * 16 // 9, vcodec='avc1', acodec='none', ext='mp4', **size)
+
+AUDIO = dict(format_id='a', vcodec='none', acodec='mp4a', ext='m4a', abr=128, filesize=1_000_000)
+
+def test_unknown_size_does_not_win():
+    info = {'duration': 60, 'formats': [_video('unknown', 720), _video('known', 1080, filesize=20_000_000), AUDIO]}
+    assert select_source(info, "mp4", 60).spec.startswith('known+a')
+
+def test_size_is_estimated_from_bitrate():
+    info = {'duration': 60, 'formats': [
+        _video('big', 720, tbr=4000), _video('small', 1080, tbr=1000), _video('unknown', 720), AUDIO
+    ]}
+    assert select_source(info, "mp4", 60).spec.startswith('small+a')
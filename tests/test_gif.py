@@ -0,0 +1,13 @@
+from lib.gif import plan_gif, GIF_PALETTES
+from lib.utils import MAX_GIF_FRAMES, MAX_GIF_LENGTH, SAFE_GIF_WIDTH, SAFE_GIF_FPS
+
+# Tiny bytes per frame-pixel, so every setting fits the size budget
+SAMPLES = [1e-6] * len(GIF_PALETTES)
+
+def test_long_gif_stays_within_frame_budget():
+    plan = plan_gif(SAMPLES, 1280, 720, MAX_GIF_LENGTH, SAFE_GIF_WIDTH, SAFE_GIF_FPS)
+    assert plan.fps * MAX_GIF_LENGTH <= MAX_GIF_FRAMES
+
+def test_short_gif_keeps_full_framerate():
+    plan = plan_gif(SAMPLES, 1280, 720, 5, SAFE_GIF_WIDTH, SAFE_GIF_FPS)
+    assert plan.fps == SAFE_GIF_FPS
@@ -0,0 +1,27 @@
+import shutil
+import multiprocessing
+import pytest
+from lib.workers import _apply_limits
+from lib.stream import run_ffmpeg
+from lib.utils import WORKER_MEMORY_MB, WORKER_CPU_SECONDS
+
+def _encode_under_limits(result):
+    _apply_limits(WORKER_MEMORY_MB, WORKER_CPU_SECONDS)
+    try:
+        run_ffmpeg([
+            'ffmpeg', '-f', 'lavfi', '-i', 'testsrc2=size=1920x1080:rate=30:duration=2',
+            '-c:v', 'libx264', '-preset', 'fast', '-threads', '4', '-f', 'null', '-'
+        ])
+        result.put(None)
+    except Exception as e:
+        result.put(f"{type(e).__name__}: {e}")
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason="ffmpeg is not installed")
+def test_multithreaded_x264_runs_under_worker_limits():
+    ctx = multiprocessing.get_context("spawn")
+    result = ctx.Queue()
+    process = ctx.Process(target=_encode_under_limits, args=(result,))
+    process.start()
+    error = result.get(timeout=120)
+    process.join()
+    assert error is None